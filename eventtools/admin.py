@@ -14,12 +14,13 @@ from django.shortcuts import get_object_or_404, redirect
 from django.forms.models import BaseInlineFormSet
 from mptt.forms import TreeNodeChoiceField
 from mptt.admin import MPTTModelAdmin
-from django.utils.translation import ugettext, ugettext_lazy as _
+from django.utils.translation import ugettext, ungettext, ugettext_lazy as _
 from django.template.defaultfilters import date, time
 
 from utils.diff import generate_diff
 
 from .models import Rule
+from .signals import occurrences_changed
 
 import django
 if django.VERSION[0] == 1 and django.VERSION[1] >= 4:
@@ -42,12 +43,45 @@ class TreeModelChoiceField(forms.ModelChoiceField):
 
 
 # ADMIN ACTIONS
+def _exclude_generated(queryset):
+    """
+    Adds exclusions for the generated occurrences in queryset, so that they
+    aren't recreated by their generators, and unhooks them. Returns a tuple
+    of (number of exclusions added, number of occurrences unhooked).
+    """
+    pairs = queryset.filter(generated_by__isnull=False).order_by() \
+        .values_list('event_id', 'start')
+    ExclusionModel = queryset.model.EventModel().ExclusionModel()
+    return ExclusionModel.objects.bulk_exclude(pairs)
+
+def _exclusions_message(excluded):
+    return ungettext(
+        "Added %(count)d exclusion, so it won't be recreated by a repeating occurrence.",
+        "Added %(count)d exclusions, so they won't be recreated by repeating occurrences.",
+        excluded) % {'count': excluded}
+
 def _remove_occurrences(modeladmin, request, queryset):
-    for m in queryset:
-        # if the occurrence was generated, then add it as an exclusion.
-        if m.generated_by is not None:
-            m.event.exclusions.get_or_create(start=m.start)
-        m.delete()
+    # _exclude_generated() unhooks the occurrences, after which the
+    # changelist's queryset may not match them (eg. filtered by
+    # IsGeneratedListFilter), so fix the selection first.
+    queryset = queryset.model._default_manager.filter(
+        pk__in=list(queryset.values_list('pk', flat=True)))
+    event_ids = set(queryset.order_by().values_list('event_id', flat=True).distinct())
+    excluded = _exclude_generated(queryset)[0]
+    deleted, unhooked = queryset.delete_or_unhook()
+    # delete_or_unhook() leaves it to us to tell listeners (eg. summaries)
+    occurrences_changed.send(sender=queryset.model.EventModel(),
+        event_ids=event_ids)
+    message = [ungettext("Deleted %(count)d occurrence.",
+        "Deleted %(count)d occurrences.", deleted) % {'count': deleted}]
+    if unhooked:
+        message.append(ungettext(
+            "%(count)d occurrence is used elsewhere, so was made one-off instead.",
+            "%(count)d occurrences are used elsewhere, so were made one-off instead.",
+            unhooked) % {'count': unhooked})
+    if excluded:
+        message.append(_exclusions_message(excluded))
+    modeladmin.message_user(request, " ".join(message))
 _remove_occurrences.short_description = _("Delete occurrences (and prevent recreation by a repeating occurrence)")
 
 def _wipe_occurrences(modeladmin, request, queryset):
@@ -55,23 +89,31 @@ def _wipe_occurrences(modeladmin, request, queryset):
 _wipe_occurrences.short_description = _("Delete occurrences (but allow recreation by a repeating occurrence)")
 
 def _convert_to_oneoff(modeladmin, request, queryset):
-    for m in queryset:
-        # if the occurrence was generated, then add it as an exclusion.
-        if m.generated_by is not None:
-            m.event.exclusions.get_or_create(start=m.start)
-    queryset.update(generated_by=None)
+    excluded, converted = _exclude_generated(queryset)
+    message = [ungettext("Made %(count)d occurrence one-off.",
+        "Made %(count)d occurrences one-off.", converted) % {'count': converted}]
+    if excluded:
+        message.append(_exclusions_message(excluded))
+    modeladmin.message_user(request, " ".join(message))
 _convert_to_oneoff.short_description = _("Make occurrences one-off (and prevent recreation by a repeating occurrence)")
 
+def _set_status(queryset, status):
+    # update() doesn't send post_save, so tell listeners (eg. event summaries)
+    event_ids = set(queryset.order_by().values_list('event_id', flat=True).distinct())
+    queryset.update(status=status)
+    occurrences_changed.send(sender=queryset.model.EventModel(),
+        event_ids=event_ids)
+
 def _cancel(modeladmin, request, queryset):
-    queryset.update(status=settings.OCCURRENCE_STATUS_CANCELLED[0])
+    _set_status(queryset, settings.OCCURRENCE_STATUS_CANCELLED[0])
 _cancel.short_description = _("Make occurrences cancelled")
 
 def _fully_booked(modeladmin, request, queryset):
-    queryset.update(status=settings.OCCURRENCE_STATUS_FULLY_BOOKED[0])
+    _set_status(queryset, settings.OCCURRENCE_STATUS_FULLY_BOOKED[0])
 _fully_booked.short_description = _("Make occurrences fully booked")
 
 def _clear_status(modeladmin, request, queryset):
-    queryset.update(status="")
+    _set_status(queryset, "")
 _clear_status.short_description = _("Clear booked/cancelled status")
 
 class OccurrenceAdminForm(forms.ModelForm):
@@ -226,6 +268,21 @@ def EventForm(EventModel):
 
         class Meta:
             model = EventModel
+
+        def __init__(self, *args, **kwargs):
+            super(_EventForm, self).__init__(*args, **kwargs)
+            # a new variation starts with its parent's inherited values, if
+            # they weren't given (eg. by _create_variation)
+            parent_id = self.initial.get('parent')
+            missing = [f for f in EventModel._event_meta.fields_to_inherit
+                if f not in self.initial]
+            if parent_id and missing and not self.instance.pk:
+                try:
+                    parent = EventModel._event_manager.get(pk=parent_id)
+                except (EventModel.DoesNotExist, ValueError):
+                    return
+                for field_name, value in parent.variation_initial().items():
+                    self.initial.setdefault(field_name, value)
     return _EventForm
 
 
@@ -244,8 +301,16 @@ def EventAdmin(EventModel, SuperModel=MPTTModelAdmin, Mixin=NoopMixin, show_excl
         prepopulated_fields = {'slug': ('title', )}
         search_fields = ('title',)
 
-#        def queryset(self, request):
-#             return EventModel.objects.annotate(occurrence_count=Count('occurrences'))
+        def queryset(self, request):
+            """
+            Annotates the events with what the changelist shows, so that a page
+            of events takes one query rather than several per event.
+            """
+            qs = super(_EventAdmin, self).queryset(request)
+            # the default manager's queryset may not be an EventQuerySet
+            if not hasattr(qs, 'with_admin_summary'):
+                qs = qs._clone(klass=EventModel._event_manager.get_query_set().__class__)
+            return qs.with_admin_summary()
 
         def append_eventtools_inlines(self, inline_instances):
             eventtools_inlines = [
@@ -300,8 +365,13 @@ def EventAdmin(EventModel, SuperModel=MPTTModelAdmin, Mixin=NoopMixin, show_excl
                 )
 
         def occurrence_link(self, event):
-            count = event.occurrences_in_listing().count()
-            direct_count = event.occurrences.count()
+            # annotated by queryset()
+            count = getattr(event, 'listing_occurrence_count', None)
+            if count is None:
+                count = event.occurrences_in_listing().count()
+            direct_count = getattr(event, 'direct_occurrence_count', None)
+            if direct_count is None:
+                direct_count = event.occurrences.count()
 
             url = self.occurrence_edit_url(event)
 
@@ -331,25 +401,17 @@ def EventAdmin(EventModel, SuperModel=MPTTModelAdmin, Mixin=NoopMixin, show_excl
             Instead, we'll get the parent and inheriting fields out of Event
             and put them into a GET string for the new_event form.
 
-            To get values, we first try inheritable_FOO, to populate the form.
+            The values come from EventModel.variation_initial(), which first
+            tries inheritable_FOO, to populate the form.
 
             @property
             def inheritable_price:
                 return self.price.raw
             """
             parent = get_object_or_404(EventModel, id=parent_id)
-            GET = QueryDict("parent=%s" % parent.id).copy()
-
-            for field_name in EventModel._event_meta.fields_to_inherit:
-                inheritable_field_name = "inheritable_%s" % field_name
-                parent_attr =  getattr(parent, inheritable_field_name, getattr(parent, field_name))
-                if parent_attr:
-                    if hasattr(parent_attr, 'all'): #for m2m. Sufficient?
-                        GET[field_name] = u",".join([unicode(i.pk) for i in parent_attr.all()])
-                    elif hasattr(parent_attr, 'pk'): #for fk. Sufficient?
-                        GET[field_name] = parent_attr.pk
-                    else:
-                        GET[field_name] = parent_attr
+            GET = QueryDict("").copy()
+            for field_name, value in parent.variation_initial().items():
+                GET[field_name] = value
 
             return redirect(
                 reverse("%s:%s_%s_add" % (
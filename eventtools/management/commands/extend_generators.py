@@ -0,0 +1,58 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import get_models
+from django.utils.encoding import smart_str
+
+from eventtools.models import GeneratorModel
+
+
+class Command(BaseCommand):
+    help = "Generates the occurrences of endless repeating occurrences " \
+        "(generators) up to the generation limit, leaving existing " \
+        "occurrences untouched. Run this regularly, eg daily from cron."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size',
+            default=100,
+            help='How many generators to fetch at a time (default 100).'),
+        make_option('--all', action='store_true', dest='all', default=False,
+            help='Extend all generators, not just those without a '
+                '"repeat until" date.'),
+    )
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+        generator_models = [
+            m for m in get_models() if issubclass(m, GeneratorModel)]
+
+        total_generators = total_created = failures = 0
+        total_seconds = 0.0
+
+        for GeneratorClass in generator_models:
+            if options['all']:
+                queryset = GeneratorClass._default_manager.all()
+            else:
+                queryset = None # endless generators
+
+            for generator, created, seconds, error in GeneratorClass \
+                    .extend_all(queryset, batch_size=options['batch_size']):
+                total_generators += 1
+                total_seconds += seconds
+                if error is not None:
+                    failures += 1
+                    self.stderr.write(smart_str(u"%s #%s (%s): failed after %.3fs: %r\n" % (
+                        GeneratorClass.__name__, generator.pk, generator,
+                        seconds, error)))
+                    continue
+                total_created += created
+                if verbosity >= 1:
+                    self.stdout.write(smart_str(u"%s #%s (%s): %s occurrences created in %.3fs\n" % (
+                        GeneratorClass.__name__, generator.pk, generator,
+                        created, seconds)))
+
+        if verbosity >= 1:
+            self.stdout.write(u"Extended %s generators: %s occurrences created in %.3fs\n" % (
+                total_generators, total_created, total_seconds))
+        if failures:
+            raise CommandError("%s generators could not be extended" % failures)
@@ -0,0 +1,45 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import get_models
+
+from eventtools.models import EventModel
+
+
+class Command(BaseCommand):
+    help = "Recalculates the occurrence summaries of all events, for Event " \
+        "models that have summaries enabled (see EventSummaryModel)."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size',
+            default=100,
+            help='How many events to fetch at a time (default 100).'),
+    )
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+        batch_size = options['batch_size']
+        event_models = [m for m in get_models()
+            if issubclass(m, EventModel) and m.SummaryModel() is not None]
+
+        for EventClass in event_models:
+            SummaryModel = EventClass.SummaryModel()
+            count = 0
+            last_pk = None
+            while True:
+                batch = EventClass._event_manager.order_by('pk')
+                if last_pk is not None:
+                    batch = batch.filter(pk__gt=last_pk)
+                batch = list(batch[:batch_size])
+                if not batch:
+                    break
+                with transaction.commit_on_success():
+                    for event in batch:
+                        SummaryModel.refresh(event)
+                count += len(batch)
+                last_pk = batch[-1].pk
+
+            if verbosity >= 1:
+                self.stdout.write(u"Rebuilt %s %s summaries\n" % (
+                    count, EventClass.__name__))
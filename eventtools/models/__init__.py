@@ -7,4 +7,6 @@ from .event import *
 from .occurrence import *
 from .generator import *
 from .exclusion import *
+from .summary import *
+from .feedstamps import *
 from .xseason import *
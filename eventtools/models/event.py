@@ -1,10 +1,12 @@
 from operator import itemgetter
 
-from django.db import models
+from django.db import connections, models
 from django.db.models.base import ModelBase
 from django.db.models.fields import FieldDoesNotExist
 from django.db.models import Count
+from django.core.exceptions import ObjectDoesNotExist
 from django.core.urlresolvers import reverse
+from django.utils.datastructures import SortedDict
 from django.utils.timezone import localtime
 from django.utils.translation import ugettext, ugettext_lazy as _
 from django.template.defaultfilters import urlencode, slugify
@@ -12,9 +14,9 @@ from django.template.defaultfilters import urlencode, slugify
 from mptt.models import MPTTModel, MPTTModelBase
 from mptt.managers import TreeManager
 
-from eventtools.utils.inheritingdefault import ModelInstanceAwareDefault #TODO: deprecate
 from eventtools.utils.pprint_timespan import pprint_datetime_span, pprint_date_span
 from eventtools.conf import settings
+from eventtools.models.summary import ListingSummary
 
 class EventQuerySet(models.query.QuerySet):
     # much as you may be tempted to add "starts_between" and other
@@ -33,28 +35,56 @@ class EventQuerySet(models.query.QuerySet):
         Occurrence set, with no repetitions or overlaps. ie, this is probably
         what you want to show in listings.
 
-        Given that the tree is likely to be quite shallow, let's do this breadth-first.
-
-        For each level:
-        * two filter: 1) children of qs having_occurrences and 2) children of qs having_no_occurrences.
-        * 1) is added to result set.
-        * 2) is used as qs for next level
+        These are the events that have occurrences, and no ancestors with
+        occurrences. This is done in one query, using the MPTT columns to find
+        ancestors.
 
         TODO: For subqueries, this will produce results that are not in the
         superqueries, because we don't have access to potential missing parents.
-        Maybe this is desired behaviour?
-        """
-        max_level = self.aggregate(models.Max('level'))['level__max']
-
-        result = self.filter(level=0).having_occurrences()
-        qs = self.filter(level=0).having_no_occurrences()
-
-        for level in range(1, max_level+1):
-            if qs:
-                result |= self.filter(parent__in=qs).having_occurrences()
-                qs = self.filter(parent__in=qs).having_no_occurrences()
-
-        return result
+        Maybe this is desired behaviour? (For now, as before, an event is only
+        listed if all of its ancestors are in this queryset.)
+        """
+        qn = connections[self.db].ops.quote_name
+        opts = self.model._meta
+        mptt_opts = self.model._mptt_meta
+        OccurrenceModel = self.model.OccurrenceModel()
+
+        table = qn(opts.db_table)
+        pk = qn(opts.pk.column)
+        tree_id = qn(opts.get_field(mptt_opts.tree_id_attr).column)
+        lft = qn(opts.get_field(mptt_opts.left_attr).column)
+        rght = qn(opts.get_field(mptt_opts.right_attr).column)
+        occurrence_table = qn(OccurrenceModel._meta.db_table)
+        occurrence_event = qn(OccurrenceModel._meta.get_field('event').column)
+
+        # an ancestor disqualifies an event if it has occurrences...
+        disqualifying = [
+            "EXISTS (SELECT 1 FROM %s WHERE %s.%s = anc.%s)" % (
+                occurrence_table, occurrence_table, occurrence_event, pk),
+        ]
+        params = []
+        # ...or isn't in this queryset.
+        if self.query.where:
+            sql, params = self.order_by().values_list('pk', flat=True) \
+                .query.sql_with_params()
+            disqualifying.append("anc.%s NOT IN (%s)" % (pk, sql))
+
+        no_disqualifying_ancestors = """NOT EXISTS (
+            SELECT 1 FROM %(table)s anc
+            WHERE anc.%(tree_id)s = %(table)s.%(tree_id)s
+            AND anc.%(lft)s < %(table)s.%(lft)s
+            AND anc.%(rght)s > %(table)s.%(rght)s
+            AND (%(disqualifying)s)
+        )""" % {
+            'table': table,
+            'tree_id': tree_id,
+            'lft': lft,
+            'rght': rght,
+            'disqualifying': " OR ".join(disqualifying),
+        }
+
+        return self.having_occurrences().extra(
+            where=[no_disqualifying_ancestors], params=params)
 
     def occurrences(self):
         """
@@ -68,25 +98,197 @@ class EventQuerySet(models.query.QuerySet):
         """
         Returns the opening occurrences for the events in this queryset.
         """
-        pks = []
-        for e in self:
-            try:
-                pks.append(e.opening_occurrence().id)
-            except AttributeError:
-                pass
-        return self.occurrences().filter(pk__in=pks)
+        return self._boundary_occurrences('MIN')
 
     def closing_occurrences(self):
         """
         Returns the closing occurrences for the events in this queryset.
         """
-        pks = []
-        for e in self:
-            try:
-                pks.append(e.closing_occurrence().id)
-            except AttributeError:
-                pass
-        return self.occurrences().filter(pk__in=pks)
+        return self._boundary_occurrences('MAX')
+
+    def _boundary_occurrences(self, aggregate):
+        """
+        Returns the first ('MIN') or last ('MAX') occurrence in listing of each
+        event in this queryset, as a lazy queryset of one query.
+
+        The occurrence in listing of an event are those of it and its
+        descendants, ordered by start and then (for simultaneous occurrences)
+        by event, ie by position in the tree. So, for each event, we find the
+        first/last start among its descendants (using the MPTT columns), then
+        the first/last descendant with an occurrence at that time, then that
+        occurrence.
+        """
+        names = self._sql_names()
+        names['aggregate'] = aggregate
+        names['events'], params = self.order_by() \
+            .values_list('pk', flat=True).query.sql_with_params()
+
+        boundary_starts = """
+            SELECT e.%(pk)s AS event_id, e.%(tree_id)s AS tree_id,
+                e.%(lft)s AS tree_lft, e.%(rght)s AS tree_rght,
+                %(aggregate)s(o.%(start)s) AS boundary_start
+            FROM %(event_table)s e
+            INNER JOIN %(event_table)s oe ON (oe.%(tree_id)s = e.%(tree_id)s
+                AND oe.%(lft)s >= e.%(lft)s AND oe.%(lft)s <= e.%(rght)s)
+            INNER JOIN %(occurrence_table)s o
+                ON o.%(occurrence_event)s = oe.%(pk)s
+            WHERE e.%(pk)s IN (%(events)s)
+            GROUP BY e.%(pk)s, e.%(tree_id)s, e.%(lft)s, e.%(rght)s
+        """ % names
+        names['boundary_starts'] = boundary_starts
+
+        boundary_events = """
+            SELECT b.tree_id, b.boundary_start, %(aggregate)s(oe.%(lft)s) AS boundary_lft
+            FROM (%(boundary_starts)s) b
+            INNER JOIN %(event_table)s oe ON (oe.%(tree_id)s = b.tree_id
+                AND oe.%(lft)s >= b.tree_lft AND oe.%(lft)s <= b.tree_rght)
+            INNER JOIN %(occurrence_table)s o ON (
+                o.%(occurrence_event)s = oe.%(pk)s AND o.%(start)s = b.boundary_start)
+            GROUP BY b.event_id, b.tree_id, b.boundary_start
+        """ % names
+        names['boundary_events'] = boundary_events
+
+        boundary_occurrences = """%(occurrence_table)s.%(occurrence_pk)s IN (
+            SELECT o.%(occurrence_pk)s
+            FROM %(occurrence_table)s o
+            INNER JOIN %(event_table)s oe ON o.%(occurrence_event)s = oe.%(pk)s
+            INNER JOIN (%(boundary_events)s) be ON (
+                oe.%(tree_id)s = be.tree_id AND oe.%(lft)s = be.boundary_lft
+                AND o.%(start)s = be.boundary_start)
+        )""" % names
+
+        return self.occurrences().extra(
+            where=[boundary_occurrences], params=params)
+
+    def with_listing_summary(self):
+        """
+        Annotates each event with a summary of its occurrences in listing:
+        the first and last start, and the count and latest start of available,
+        cancelled and fully booked occurrences. season(), status(),
+        is_cancelled(), unavailable_status_message() etc. use these rather
+        than querying, so listing n events takes one query, not several per
+        event.
+
+        Each value is a subquery over the event's descendants (found using
+        the MPTT columns) in this queryset's query.
+        """
+        names = self._sql_names()
+        cancelled = settings.OCCURRENCE_STATUS_CANCELLED[0]
+        fully_booked = settings.OCCURRENCE_STATUS_FULLY_BOOKED[0]
+
+        aggregates = [
+            ('occurrence_count', "COUNT(*)", []),
+            ('available_count',
+                "SUM(CASE WHEN %(available)s THEN 1 ELSE 0 END)", []),
+            ('cancelled_count',
+                "SUM(CASE WHEN %(o)s.%(status)s = %%s THEN 1 ELSE 0 END)",
+                [cancelled]),
+            ('fully_booked_count',
+                "SUM(CASE WHEN %(o)s.%(status)s = %%s THEN 1 ELSE 0 END)",
+                [fully_booked]),
+            ('first_start', "MIN(%(o)s.%(start)s)", []),
+            ('last_start', "MAX(%(o)s.%(start)s)", []),
+            ('last_available_start',
+                "MAX(CASE WHEN %(available)s THEN %(o)s.%(start)s END)", []),
+            ('last_cancelled_start',
+                "MAX(CASE WHEN %(o)s.%(status)s = %%s THEN %(o)s.%(start)s END)",
+                [cancelled]),
+            ('last_uncancelled_start',
+                "MAX(CASE WHEN %(o)s.%(status)s = %%s THEN NULL ELSE %(o)s.%(start)s END)",
+                [cancelled]),
+            ('last_fully_booked_start',
+                "MAX(CASE WHEN %(o)s.%(status)s = %%s THEN %(o)s.%(start)s END)",
+                [fully_booked]),
+            # a NULL status is counted as '', as occurrence_statuses() does.
+            ('status_count', "COUNT(DISTINCT COALESCE(%(o)s.%(status)s, ''))", []),
+            ('status', "MIN(COALESCE(%(o)s.%(status)s, ''))", []),
+        ]
+
+        in_listing = """FROM %(occurrence_table)s %(o)s
+            INNER JOIN %(event_table)s %(oe)s
+                ON %(o)s.%(occurrence_event)s = %(oe)s.%(pk)s
+            WHERE %(oe)s.%(tree_id)s = %(event_table)s.%(tree_id)s
+            AND %(oe)s.%(lft)s >= %(event_table)s.%(lft)s
+            AND %(oe)s.%(lft)s <= %(event_table)s.%(rght)s"""
+
+        select = SortedDict()
+        select_params = []
+        for name, aggregate, params in aggregates:
+            # Identical subqueries are only added once to a GROUP BY (but
+            # their params are added each time), so give each subquery its
+            # own table aliases.
+            subquery_names = dict(names, o='o_' + name, oe='oe_' + name)
+            subquery_names['available'] = \
+                "(%(o)s.%(status)s = '' OR %(o)s.%(status)s IS NULL)" \
+                % subquery_names
+            select['listing_' + name] = \
+                ("SELECT " + aggregate + " " + in_listing) % subquery_names
+            select_params.extend(params)
+        # the closing occurrence is the last one in the listing order.
+        select['listing_closing_duration'] = ("SELECT %(o)s.%(duration)s " +
+            in_listing + " ORDER BY %(o)s.%(start)s DESC, %(oe)s.%(lft)s DESC LIMIT 1") \
+            % dict(names, o='o_closing', oe='oe_closing')
+
+        return self.extra(select=select, select_params=select_params)
+
+    def with_admin_summary(self):
+        """
+        Annotates each event with its listing summary (see
+        with_listing_summary()), and with what else the admin changelist
+        shows: the number of occurrences attached directly to it, and whether
+        it is listed (see is_listed()), so a changelist page takes one query.
+        """
+        names = self._sql_names()
+
+        def has_occurrences(event_pk, alias):
+            return "EXISTS (SELECT 1 FROM %s %s WHERE %s.%s = %s)" % (
+                names['occurrence_table'], alias, alias,
+                names['occurrence_event'], event_pk)
+
+        select = SortedDict()
+        select['direct_occurrence_count'] = """SELECT COUNT(*)
+            FROM %(occurrence_table)s o_direct
+            WHERE o_direct.%(occurrence_event)s = %(event_table)s.%(pk)s""" \
+            % names
+        # an event is listed if it has occurrences and no ancestor does.
+        select['listed'] = """CASE WHEN %(has_occurrences)s AND NOT EXISTS (
+                SELECT 1 FROM %(event_table)s anc
+                WHERE anc.%(tree_id)s = %(event_table)s.%(tree_id)s
+                AND anc.%(lft)s < %(event_table)s.%(lft)s
+                AND anc.%(rght)s > %(event_table)s.%(rght)s
+                AND %(ancestor_has_occurrences)s
+            ) THEN 1 ELSE 0 END""" % dict(names,
+            has_occurrences=has_occurrences(
+                "%(event_table)s.%(pk)s" % names, 'o_listed'),
+            ancestor_has_occurrences=has_occurrences(
+                "anc.%(pk)s" % names, 'o_anc_listed'),
+        )
+
+        return self.with_listing_summary().extra(select=select)
+
+    def _sql_names(self):
+        """
+        Returns the quoted table and column names used in the raw SQL above.
+        """
+        qn = connections[self.db].ops.quote_name
+        opts = self.model._meta
+        mptt_opts = self.model._mptt_meta
+        OccurrenceModel = self.model.OccurrenceModel()
+        occurrence_opts = OccurrenceModel._meta
+
+        return {
+            'event_table': qn(opts.db_table),
+            'pk': qn(opts.pk.column),
+            'tree_id': qn(opts.get_field(mptt_opts.tree_id_attr).column),
+            'lft': qn(opts.get_field(mptt_opts.left_attr).column),
+            'rght': qn(opts.get_field(mptt_opts.right_attr).column),
+            'occurrence_table': qn(occurrence_opts.db_table),
+            'occurrence_pk': qn(occurrence_opts.pk.column),
+            'occurrence_event': qn(occurrence_opts.get_field('event').column),
+            'start': qn(occurrence_opts.get_field('start').column),
+            'status': qn(occurrence_opts.get_field('status').column),
+            'duration': qn(occurrence_opts.get_field('_duration').column),
+        }
 
     #some simple annotations
     def having_occurrences(self):
@@ -118,6 +320,11 @@ class EventTreeManager(TreeManager):
     def closing_occurrences(self, *args, **kwargs):
         return self.get_query_set().closing_occurrences(*args, **kwargs)
 
+    def with_listing_summary(self):
+        return self.get_query_set().with_listing_summary()
+    def with_admin_summary(self):
+        return self.get_query_set().with_admin_summary()
+
     def having_occurrences(self):
         return self.get_query_set().having_occurrences()
     def having_n_occurrences(self, n):
@@ -170,16 +377,14 @@ class EventModelBase(MPTTModelBase):
             # copies)
             pass
         else:
-            for field_name in class_dict['_event_meta'].fields_to_inherit:
-                try:
-                    field = cls._meta.get_field(field_name)
-                    #injecting our fancy inheriting default
-                    field.default = ModelInstanceAwareDefault(
-                        field_name,
-                        field.default
-                    )
-                except models.FieldDoesNotExist:
-                    continue
+            # the (name, attname) of the fields that new variations inherit
+            # from their parent (see EventModel.__init__)
+            fields = dict((f.name, f) for f in cls._meta.fields)
+            cls._inherited_fields = [
+                (fields[name].name, fields[name].attname)
+                for name in class_dict['_event_meta'].fields_to_inherit
+                if name in fields
+            ]
 
             # Add a custom manager
             assert issubclass(
@@ -229,6 +434,18 @@ class EventModel(MPTTModel):
         abstract = True
         ordering = ['tree_id', 'lft']
 
+    def __init__(self, *args, **kwargs):
+        # A new variation inherits its parent's values of fields_to_inherit,
+        # unless they're given.
+        parent = kwargs.get('parent')
+        if parent is not None and not args:
+            for name, attname in self._inherited_fields:
+                if name not in kwargs and attname not in kwargs:
+                    kwargs[attname] = getattr(parent, attname)
+        super(EventModel, self).__init__(*args, **kwargs)
+        # so that we can tell if the event is moved to another parent.
+        self._saved_parent_id = self.__dict__.get('parent_id')
+
     def __unicode__(self):
         return self.title
 
@@ -253,11 +470,23 @@ class EventModel(MPTTModel):
         """
         return cls.exclusions.related.model
 
+    @classmethod
+    def SummaryModel(cls):
+        """
+        Returns the class used for occurrence summaries, or None if summaries
+        aren't enabled (see EventSummaryModel)
+        """
+        try:
+            return cls.occurrence_summary.related.model
+        except AttributeError:
+            return None
+
     def save(self, *args, **kwargs):
         """
         When an event is saved, the changes to fields are cascaded to children,
-        and any endless generators are updated, so that a few more occurrences
-        are generated
+        and any endless generators are extended, so that a few more occurrences
+        are generated. (Existing occurrences are left alone; change a
+        generator to regenerate it.)
         """
         #this has to happen before super.save, so that we can tell what's
         #changed
@@ -266,12 +495,37 @@ class EventModel(MPTTModel):
 
         self._cascade_changes_to_children()
         r = super(EventModel, self).save(*args, **kwargs)
+        # after post_save, whose receivers may need the previous parent
+        self._saved_parent_id = self.parent_id
 
         endless_generators = self.generators.filter(repeat_until__isnull=True)
-        [g.save() for g in endless_generators]
+        [g.extend_occurrences() for g in endless_generators]
 
         return r
 
+    def variation_initial(self):
+        """
+        Returns the initial data for a form (or query string) for a new
+        variation of this event: the parent, and my values of
+        fields_to_inherit.
+
+        Values are taken from inheritable_FOO attributes where they exist, for
+        fields where the native value isn't in the right form, e.g. MarkItUp
+        fields. Related objects are given as pks.
+        """
+        initial = {'parent': self.pk}
+        for field_name in self._event_meta.fields_to_inherit:
+            inheritable_field_name = "inheritable_%s" % field_name
+            value = getattr(self, inheritable_field_name, getattr(self, field_name))
+            if value:
+                if hasattr(value, 'all'): #for m2m. Sufficient?
+                    initial[field_name] = u",".join([unicode(i.pk) for i in value.all()])
+                elif hasattr(value, 'pk'): #for fk. Sufficient?
+                    initial[field_name] = value.pk
+                else:
+                    initial[field_name] = value
+        return initial
+
     def reload(self):
         """
         Used for refreshing events in a queryset that may have changed.
@@ -281,8 +535,9 @@ class EventModel(MPTTModel):
 
     def _cascade_changes_to_children(self):
         """
-        Go through the fields_to_inherit, and apply my values to my children,
-        if my children don't have altered values.
+        Go through the fields_to_inherit, and apply my values to my descendants,
+        if their values haven't been altered from their parent's (ie if they
+        still inherit them).
 
         Now tries 'inheritable_FOO' attributes for getting attributes where the
         native value isn't in the right form,
@@ -291,24 +546,76 @@ class EventModel(MPTTModel):
         @property
         def inheritable_price:
             return self.price.raw
-        """
-        if self.pk:
-            saved_self = type(self)._event_manager.get(pk=self.pk)
-            attribs = type(self)._event_meta.fields_to_inherit
-
-            for child in self.get_children():
-                for a in attribs:
-                    inheritable_attr = "inheritable_%s" % a
-                    try:
-                        saved_value = getattr(saved_self, inheritable_attr, getattr(saved_self, a))
-                        ch_value =  getattr(child, inheritable_attr, getattr(child, a))
-                        if ch_value == saved_value:
-                            #the child's value is unchanged from the parent
-                            new_value = getattr(self, inheritable_attr, getattr(self, a))
-                            setattr(child, a, new_value)
-                    except AttributeError:
-                        continue
-                child.save() #cascades to grandchildren
+
+        The saved values of the whole subtree are loaded in one query, and the
+        descendants that change are updated with one update() per field and
+        value, rather than by saving each of them (so their post_save isn't
+        sent, and their generators aren't extended).
+
+        update() doesn't call Field.pre_save(), though, so if a changed field
+        has an inheritable_FOO attribute, or does more than store its value
+        when it's saved (eg. a MarkItUp field, which renders the value into
+        another column), or the model has an auto_now field, the descendants
+        that change are saved instead (without cascading again).
+        """
+        if not self.pk or not self._inherited_fields:
+            return
+
+        subtree = list(self.get_descendants(include_self=True).order_by(
+            self._mptt_meta.left_attr))
+        if len(subtree) < 2:
+            return
+        manager = type(self)._event_manager
+        # {pk: {attname: new value}} of the descendants to save, not update()
+        save_values = {}
+        save_all = any(getattr(f, 'auto_now', False) for f in self._meta.fields)
+
+        for name, attname in self._inherited_fields:
+            if name != attname: # compare FKs by id, not by fetching them
+                value = lambda event: getattr(event, attname)
+            else:
+                value = lambda event: getattr(event,
+                    "inheritable_%s" % name, getattr(event, name))
+
+            # the saved and new values of each event in the subtree. Parents
+            # come before their children.
+            saved_values = {}
+            new_values = {}
+            updates = [] # [new value, [pks]]
+            for event in subtree:
+                saved_value = value(event)
+                saved_values[event.pk] = saved_value
+                if event.pk == self.pk:
+                    new_value = value(self)
+                else:
+                    new_value = saved_value
+                    parent_id = event.parent_id
+                    if parent_id in saved_values \
+                            and saved_value == saved_values[parent_id] \
+                            and new_values[parent_id] != saved_value:
+                        #the child's value is unchanged from the parent
+                        new_value = new_values[parent_id]
+                        for update in updates:
+                            if update[0] == new_value:
+                                update[1].append(event.pk)
+                                break
+                        else:
+                            updates.append([new_value, [event.pk]])
+                new_values[event.pk] = new_value
+
+            if save_all or _saves_specially(type(self), name):
+                for new_value, pks in updates:
+                    for pk in pks:
+                        save_values.setdefault(pk, {})[attname] = new_value
+            else:
+                for new_value, pks in updates:
+                    manager.filter(pk__in=pks).update(**{name: new_value})
+
+        for event in subtree: # parents first
+            if event.pk in save_values:
+                for attname, new_value in save_values[event.pk].items():
+                    setattr(event, attname, new_value)
+                super(EventModel, event).save()
 
     def occurrences_in_listing(self):
         """
@@ -323,6 +630,19 @@ class EventModel(MPTTModel):
         """
         return self.get_descendants(include_self=True).occurrences()
 
+    def excluded_starts(self):
+        """
+        Returns a frozenset of the starts of my exclusions. It's loaded once
+        and kept on this instance (until an exclusion of this instance is
+        saved or deleted), so checking many occurrences against it doesn't
+        query. To load it for many events at once, use
+        eventtools.models.exclusion.load_excluded_starts().
+        """
+        if '_excluded_starts' not in self.__dict__:
+            self._excluded_starts = frozenset(
+                self.exclusions.values_list('start', flat=True))
+        return self._excluded_starts
+
     def opening_occurrence(self):
         try:
             return self.occurrences_in_listing().all()[0]
@@ -335,11 +655,49 @@ class EventModel(MPTTModel):
         except IndexError:
             return None
 
+    def _occurrence_summary(self):
+        """
+        Returns a summary of my occurrences in listing: a ListingSummary if I
+        was loaded with EventQuerySet.with_listing_summary(), otherwise my
+        EventSummaryModel instance. Returns None if neither is available, in
+        which case callers should query the occurrences.
+        """
+        if 'listing_occurrence_count' in self.__dict__:
+            if '_listing_summary' not in self.__dict__:
+                self._listing_summary = ListingSummary(self)
+            return self._listing_summary
+        return self._stored_occurrence_summary()
+
+    def _stored_occurrence_summary(self):
+        """
+        Returns my EventSummaryModel instance, or None if summaries aren't
+        enabled or mine hasn't been built yet.
+        """
+        if not self.pk or self.SummaryModel() is None:
+            return None
+        try:
+            return self.occurrence_summary
+        except ObjectDoesNotExist:
+            return None
+
+    def refresh_summary(self):
+        """
+        Recalculates my occurrence summary, if summaries are enabled.
+        """
+        SummaryModel = self.SummaryModel()
+        if SummaryModel is not None:
+            SummaryModel.refresh(self)
+            # discard the cached summary
+            self.__dict__.pop(type(self).occurrence_summary.cache_name, None)
+
     def get_absolute_url(self):
         return reverse('events:event', kwargs={'event_slug': self.slug })
 
     def is_finished(self):
         """ the event has finished if the closing occurrence has finished. """
+        summary = self._occurrence_summary()
+        if summary is not None:
+            return summary.is_finished()
         closing_occurrence = self.closing_occurrence()
         if closing_occurrence:
             return closing_occurrence.is_finished()
@@ -356,6 +714,8 @@ class EventModel(MPTTModel):
         return None
 
     def is_listed(self):
+        if 'listed' in self.__dict__: # see EventQuerySet.with_admin_summary()
+            return bool(self.listed)
         return self.listed_under() == self
     is_listed.boolean = True
 
@@ -366,6 +726,13 @@ class EventModel(MPTTModel):
         if self.season_description:
             return self.season_description
 
+        summary = self._occurrence_summary()
+        if summary is not None:
+            if summary.first_start and summary.last_start:
+                return pprint_date_span(localtime(summary.first_start).date(),
+                    localtime(summary.last_start).date())
+            return None
+
         o = self.opening_occurrence()
         c = self.closing_occurrence()
 
@@ -380,12 +747,18 @@ class EventModel(MPTTModel):
         return self.sessions_description or ''
 
     def occurrence_statuses(self):
-        #returns a set of statuses of my occurrences
-        return set(self.occurrences_in_listing().values_list('status', flat=True).distinct())
+        #returns a set of statuses of my occurrences ('' for no status)
+        statuses = self.occurrences_in_listing().values_list('status', flat=True).distinct()
+        return set(status or "" for status in statuses)
 
     def status(self):
         #returns a status if all occurrences have the same status.
         #Used in admin listing
+        summary = self._occurrence_summary()
+        if summary is not None:
+            if summary.status_count == 1:
+                return summary.status
+            return "(various)"
         statuses = self.occurrence_statuses()
         if len(statuses) == 1:
             return list(statuses)[0]
@@ -393,11 +766,17 @@ class EventModel(MPTTModel):
 
     def is_cancelled(self):
         """Return True if all occurrences are cancelled"""
+        summary = self._occurrence_summary()
+        if summary is not None:
+            return summary.is_cancelled()
         cancelled = self.cancelled_occurrences().count()
         return cancelled > 0 and self.occurrences_in_listing().count() == cancelled
 
     def forthcoming_is_cancelled(self):
         """Return True if all forthcoming occurrences are cancelled"""
+        summary = self._occurrence_summary()
+        if summary is not None:
+            return summary.forthcoming_is_cancelled()
         forthcoming = self.occurrences_in_listing().forthcoming().count()
         cancelled_forthcoming = self.cancelled_occurrences().forthcoming().count()
         return cancelled_forthcoming > 0 and forthcoming == cancelled_forthcoming
@@ -406,18 +785,27 @@ class EventModel(MPTTModel):
         """
         Return True if no occurrences are available and at least one is fully booked. (a mix of cancelled and fully booked is allowed)
         """
+        summary = self._occurrence_summary()
+        if summary is not None:
+            return summary.is_fully_booked()
         return self.available_occurrences().count() == 0 and self.fully_booked_occurrences().count() > 0
 
     def forthcoming_is_fully_booked(self):
         """
         Return True if no forthcoming occurrences are available and at least one is fully booked. (a mix of cancelled and fully booked is allowed)
         """
+        summary = self._occurrence_summary()
+        if summary is not None:
+            return summary.forthcoming_is_fully_booked()
         return self.available_occurrences().forthcoming().count() == 0 and self.fully_booked_occurrences().forthcoming().count() > 0
 
     def is_available(self):
         """
         Return True if any sessions are available (ie not cancelled or fully booked)
         """
+        summary = self._occurrence_summary()
+        if summary is not None:
+            return summary.is_available()
         return self.available_occurrences().count() > 0
 
     def unavailable_status_message(self):
@@ -457,10 +845,14 @@ class EventModel(MPTTModel):
         if not formatting: # use default formatting
             formatting = '%I.%M%p'
 
-        starting_times = list(set([
-            localtime(occurrence.start).time()
-            for occurrence in self.occurrences.all()
-        ]))
+        summary = self._stored_occurrence_summary()
+        if summary is not None:
+            starting_times = [t for t in [summary.start_time] if t is not None]
+        else:
+            starting_times = list(set([
+                localtime(occurrence.start).time()
+                for occurrence in self.occurrences.all()
+            ]))
 
         if len(starting_times) == 1:
             # `lower` converts Django's 'PM' into 'pm' and `lstrip` removes any leading '0'
@@ -477,3 +869,16 @@ class EventModel(MPTTModel):
 
     def gcal_url(self):
          return  "http://www.google.com/calendar/render?cid=%s" % urlencode(self.ical_url())
+
+
+def _saves_specially(model, name):
+    """
+    Returns whether the field `name` of the event model has to be saved,
+    rather than set with update(), for its value to be stored properly.
+    """
+    if hasattr(model, 'inheritable_%s' % name):
+        return True
+    field = model._meta.get_field(name)
+    if isinstance(field, models.DateField):
+        return field.auto_now
+    return type(field).pre_save.im_func is not models.Field.pre_save.im_func
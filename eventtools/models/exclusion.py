@@ -1,9 +1,57 @@
 # (We thought of calling it Exceptions, but Python has them)
 
+from django.conf import settings as django_settings
 from django.db import models
-from django.utils.timezone import localtime
+from django.utils.timezone import get_default_timezone, is_naive, localtime, \
+    make_aware
 from django.utils.translation import ugettext, ugettext_lazy as _
 
+class ExclusionManager(models.Manager):
+
+    def bulk_exclude(self, pairs):
+        """
+        Excludes each (event, start) in pairs, where event is an event or its
+        pk: adds the exclusions that don't exist yet, and unhooks the
+        generated occurrences at those times, as save() does for one
+        exclusion. This takes a constant number of queries, however many
+        pairs there are.
+
+        Returns a tuple of (number of exclusions added, number of occurrences
+        unhooked).
+        """
+        excluded = set()
+        for event, start in pairs:
+            if django_settings.USE_TZ and is_naive(start):
+                start = make_aware(start, get_default_timezone())
+            excluded.add((getattr(event, 'pk', event), start))
+            _forget_excluded_starts(event)
+        if not excluded:
+            return 0, 0
+        event_ids = set(event_id for event_id, start in excluded)
+        starts = set(start for event_id, start in excluded)
+
+        new = excluded - set(self.filter(event__in=event_ids)
+            .values_list('event_id', 'start'))
+        self.bulk_create([self.model(event_id=event_id, start=start)
+            for event_id, start in new])
+
+        occurrences = self.model._meta.get_field('event').rel.to \
+            .OccurrenceModel()._default_manager
+        clashing = [pk for pk, event_id, start in occurrences.filter(
+                event__in=event_ids, start__in=starts,
+                generated_by__isnull=False,
+            ).values_list('pk', 'event_id', 'start')
+            if (event_id, start) in excluded]
+        if clashing:
+            occurrences.filter(pk__in=clashing).update(generated_by=None)
+
+        # bulk_create() and update() don't send post_save, which would
+        # expire the feeds.
+        from eventtools.models.feedstamps import expire_event_stamps
+        expire_event_stamps(self.model._meta.get_field('event').rel.to,
+            event_ids)
+        return len(new), len(clashing)
+
 class ExclusionModel(models.Model):
     """
     Represents the time of an occurrence which is not to be generated for a given event.
@@ -12,9 +60,13 @@ class ExclusionModel(models.Model):
     subclass. The related_name for the ForeignKey should be 'exclusions'.
     
     event = models.ForeignKey(SomeEvent, related_name="exclusions")
+
+    To exclude many times at once, use ExclusionModel.objects.bulk_exclude().
     """
     start = models.DateTimeField(db_index=True, verbose_name=_('start'))
 
+    objects = ExclusionManager()
+
     class Meta:
         abstract = True
         ordering = ('start',)
@@ -32,10 +84,36 @@ class ExclusionModel(models.Model):
         be unhooked.
         """
         r = super(ExclusionModel, self).save(*args, **kwargs)
+        _forget_excluded_starts(self.event)
         
-        clashing = self.event.occurrences.filter(start = self.start, generated_by__isnull=False)
-        for c in clashing:
-            c.generated_by = None
-            c.save()
+        self.event.occurrences.filter(start=self.start,
+            generated_by__isnull=False).update(generated_by=None)
         
         return r
+
+    def delete(self, *args, **kwargs):
+        event = getattr(self,
+            self._meta.get_field('event').get_cache_name(), None)
+        if event is not None:
+            _forget_excluded_starts(event)
+        return super(ExclusionModel, self).delete(*args, **kwargs)
+
+def _forget_excluded_starts(event):
+    # see EventModel.excluded_starts()
+    getattr(event, '__dict__', {}).pop('_excluded_starts', None)
+
+def load_excluded_starts(events):
+    """
+    Loads the excluded starts (see EventModel.excluded_starts()) of the given
+    events, in one query.
+    """
+    events = [e for e in events if '_excluded_starts' not in e.__dict__]
+    if not events:
+        return
+    ExclusionModel = type(events[0]).ExclusionModel()
+    starts = {}
+    for event_id, start in ExclusionModel._default_manager.filter(
+            event__in=set(e.pk for e in events)).values_list('event_id', 'start'):
+        starts.setdefault(event_id, set()).add(start)
+    for event in events:
+        event._excluded_starts = frozenset(starts.get(event.pk, ()))
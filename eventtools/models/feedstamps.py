@@ -0,0 +1,69 @@
+"""
+Expires the iCal feed stamps (see eventtools.utils.icalcache) when the
+occurrences, generators, exclusions or events in the feeds change.
+
+A change made in a transaction is only seen by feed requests once the
+transaction is committed. Until then, a feed request could make a new stamp
+and cache the old feed under it. So stamps expired in a transaction are
+expired again at the end of the request (eg. after the admin's transaction
+is committed).
+"""
+from threading import local
+
+from django.core.signals import request_finished
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from eventtools.models.event import EventModel
+from eventtools.models.exclusion import ExclusionModel
+from eventtools.models.occurrence import OccurrenceModel
+from eventtools.signals import occurrences_changed
+from eventtools.utils.icalcache import all_events_stamp_key, \
+    event_stamp_key, expire_stamps
+
+# the stamps to expire again at the end of this thread's request.
+_expire_after_request = local()
+
+
+def expire_event_stamps(EventModel, event_ids):
+    """
+    Expires the stamps of the feeds of the given events, and of all events.
+    """
+    keys = [all_events_stamp_key(EventModel)]
+    keys.extend(event_stamp_key(EventModel, pk)
+        for pk in set(event_ids) - set([None]))
+    expire_stamps(keys)
+    if transaction.is_managed():
+        _expire_after_request.__dict__.setdefault('keys', set()).update(keys)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def _changed(sender, instance, **kwargs):
+    if issubclass(sender, OccurrenceModel):
+        # the occurrence may have been moved from another event.
+        expire_event_stamps(sender.EventModel(),
+            [instance.event_id, instance._saved_event_id])
+    elif issubclass(sender, ExclusionModel):
+        expire_event_stamps(sender._meta.get_field('event').rel.to,
+            [instance.event_id])
+    elif issubclass(sender, EventModel):
+        # the feeds of variations may show details inherited from me.
+        event_ids = [instance.pk]
+        if kwargs.get('created') is False:
+            event_ids.extend(
+                instance.get_descendants().values_list('pk', flat=True))
+        expire_event_stamps(sender, event_ids)
+
+
+@receiver(occurrences_changed)
+def _occurrences_changed(sender, event_ids, **kwargs):
+    expire_event_stamps(sender, event_ids)
+
+
+@receiver(request_finished)
+def _request_finished(sender, **kwargs):
+    keys = _expire_after_request.__dict__.pop('keys', None)
+    if keys:
+        expire_stamps(keys)
@@ -1,20 +1,29 @@
 # -*- coding: utf-8 -*-
 
 
-from django.db import models, transaction
+from django.conf import settings as django_settings
+from django.db import connections, models, transaction
+from django.db.models import F, Max, Min
 from django.db.models.base import ModelBase
 from django.utils.translation import ugettext, ugettext_lazy as _
-from django.utils.timezone import get_current_timezone, localtime
+from django.utils.timezone import get_current_timezone, get_default_timezone, \
+    is_naive, localtime, make_aware
 from django.core import exceptions
 
 from dateutil import rrule
 from eventtools.models.xtimespan import XTimespanModel
 
 from eventtools.conf import settings
+from eventtools.signals import occurrences_changed
 from eventtools.utils.pprint_timespan import (
     pprint_datetime_span, pprint_date_span)
 
 from datetime import date, time, datetime, timedelta
+from timeit import default_timer
+
+# Changes to these fields change the occurrences a generator generates.
+OCCURRENCE_FIELDS = ('event_id', 'rule_id', 'start', '_duration', 'repeat_until')
+_UNKNOWN = object()
 
 class GeneratorModel(XTimespanModel):
     """
@@ -24,6 +33,11 @@ class GeneratorModel(XTimespanModel):
     The public API is quite simple:
     
     save() generates Occurrences.
+
+    extend_occurrences() generates only the Occurrences that fall after the
+    last generated one (used to keep endless generators rolling forward).
+    extend_all() does this for many generators, eg from a cron job (see the
+    extend_generators management command).
     
     clean() makes sure the Generator has valid values (and is called by admin
     before the instance is saved)
@@ -51,9 +65,51 @@ class GeneratorModel(XTimespanModel):
         verbose_name = _("repeating occurrence")
         verbose_name_plural = _("repeating occurrences")
 
+    def __init__(self, *args, **kwargs):
+        super(GeneratorModel, self).__init__(*args, **kwargs)
+        self._record_saved_state()
+
     def __unicode__(self):
         return u"%s, %s" % (self.event, self.robot_description())
+
+    def _record_saved_state(self):
+        # Read from __dict__ so that deferred fields aren't loaded here.
+        self._saved_state = dict(
+            (f, self.__dict__.get(f, _UNKNOWN)) for f in OCCURRENCE_FIELDS)
+
+    def changed_occurrence_fields(self):
+        """
+        Returns the names of the fields that affect generated occurrences and
+        have changed since this generator was loaded or last saved. For an
+        unsaved generator, all of them are returned.
+        """
+        if not self.pk:
+            return list(OCCURRENCE_FIELDS)
+        changed = []
+        for f in OCCURRENCE_FIELDS:
+            saved, value = self._saved_state[f], getattr(self, f)
+            if f == 'start' and saved not in (None, _UNKNOWN) \
+                    and value is not None:
+                # a naive start can be assigned to a loaded (aware) one, so
+                # compare them as they are saved.
+                saved, value = _make_aware(saved), _make_aware(value)
+            if saved is _UNKNOWN or saved != value:
+                changed.append(f)
+        return changed
         
+    def _occurrence_event_ids(self):
+        """
+        Returns the pks of the events that my occurrences are attached to
+        (they may have been moved to child events), and of my saved event.
+        """
+        event_ids = set()
+        if self._saved_state['event_id'] not in (None, _UNKNOWN):
+            event_ids.add(self._saved_state['event_id'])
+        if self.pk:
+            event_ids.update(self.occurrences.order_by()
+                .values_list('event_id', flat=True).distinct())
+        return event_ids
+
     @classmethod
     def EventModel(cls):
         return cls._meta.get_field('event').rel.to
@@ -69,7 +125,6 @@ class GeneratorModel(XTimespanModel):
             
         self.is_clean = True
 
-    @transaction.commit_on_success()
     def save(self, *args, **kwargs):
         """
         Generally (and for a combination of field changes), we take a
@@ -83,32 +138,119 @@ class GeneratorModel(XTimespanModel):
             * For existing occurrences that are not candidates, unhook them from
                 the generator.
 
-        Finally, we also update other generators, because they might have had
-        clashing occurrences which no longer clash.
+        If none of the OCCURRENCE_FIELDS of an existing generator have
+        changed, its occurrences are left alone, and only the ones that are
+        due are generated, as in extend_occurrences().
+
+        Finally, if any of the OCCURRENCE_FIELDS of an existing generator
+        have changed, we also update other generators, because they might
+        have had clashing occurrences which no longer clash.
+
+        All this is done in one transaction, and occurrences_changed is sent
+        once it has been committed, so that feeds aren't cached with the old
+        occurrences in the meantime.
+        """
+        with transaction.commit_on_success():
+            r, event_ids = self._save(*args, **kwargs)
+        occurrences_changed.send(sender=self.EventModel(), event_ids=event_ids)
+        return r
+
+    def _save(self, *args, **kwargs):
+        """
+        Saves me and updates my occurrences (see save()), in the caller's
+        transaction, so that the cascaded saves of other generators are in
+        the same one. Returns the result of Model.save() and the set of pks
+        of the events whose occurrences may have changed.
         """
-        
         cascade = kwargs.pop('cascade', True)
+        resync = kwargs.pop('resync', False)
         
         if not getattr(self, 'is_clean', False):
             # if we're saving directly, the ModelForm clean isn't called, so
             # we do it here.
             self.clean(ExceptionClass=AttributeError)
-        
+
+        is_new = not self.pk
+        changed = self.changed_occurrence_fields()
+        event_ids = self._occurrence_event_ids()
+
         # Occurrences updates/generates
-        if self.pk:
+        if not is_new and changed:
             self._update_existing_occurrences() # need to do this before save, so we can detect changes
         r = super(GeneratorModel, self).save(*args, **kwargs)
-        self._sync_occurrences() #need to do this after save, so we have a pk to hang new occurrences from.
+        if is_new or changed or resync:
+            self._sync_occurrences() #need to do this after save, so we have a pk to hang new occurrences from.
+        else:
+            # nothing that affects my occurrences has changed, so just
+            # generate any that are due (see extend_occurrences()).
+            self._extend_occurrences()
+        self._record_saved_state()
+        event_ids.add(self.event_id)
     
         # finally, we should also update other generators, because they might 
-        # have had clashing occurrences
-        if cascade:
+        # have had clashing occurrences. A new generator can only take up
+        # free slots, so it can't affect the others.
+        if cascade and changed and not is_new:
             for generator in self.event.generators.exclude(pk=self.pk):
-                generator.save(cascade=False)
+                event_ids |= generator._save(cascade=False, resync=True)[1]
         
-        return r
+        return r, event_ids
+
+    def extend_occurrences(self):
+        """
+        Generates the occurrences that fall after my last generated
+        occurrence, up to the generation limit, leaving earlier occurrences
+        untouched. This is much cheaper than save(), and is used to roll
+        endless generators forward.
+
+        Returns the number of occurrences created.
+        """
+        with transaction.commit_on_success():
+            created = self._extend_occurrences()
+        if created: # after the transaction is committed, as in save()
+            occurrences_changed.send(sender=self.EventModel(),
+                event_ids=set([self.event_id]))
+        return created
+
+    def _extend_occurrences(self):
+        last_start = self.occurrences.aggregate(last=Max('start'))['last']
+        return self._sync_occurrences(after=last_start)
+
+    @classmethod
+    def extend_all(cls, queryset=None, batch_size=100):
+        """
+        Calls extend_occurrences() for each generator in `queryset` (by
+        default, all endless generators). Generators are fetched `batch_size`
+        at a time, in pk order, and each is extended in its own transaction,
+        so this is safe to run against large tables.
+
+        Yields a tuple of (generator, number of occurrences created, seconds
+        taken, exception) for each generator. If extending a generator fails,
+        its transaction is rolled back, the exception is yielded (with None
+        occurrences created) and the remaining generators are still extended.
+        """
+        if queryset is None:
+            queryset = cls._default_manager.filter(repeat_until__isnull=True)
+        queryset = queryset.select_related('event', 'rule').order_by('pk')
+
+        last_pk = None
+        while True:
+            batch = queryset
+            if last_pk is not None:
+                batch = batch.filter(pk__gt=last_pk)
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+            for generator in batch:
+                started = default_timer()
+                try:
+                    created, error = generator.extend_occurrences(), None
+                except Exception as e:
+                    created, error = None, e
+                yield generator, created, default_timer() - started, error
+            last_pk = batch[-1].pk
         
-    def _generate_dates(self):
+    def _generate_dates(self, after=None):
         drop_dead_date = datetime.combine(self.repeat_until or date.today() \
             + settings.DEFAULT_GENERATOR_LIMIT, time.max)
 
@@ -117,8 +259,15 @@ class GeneratorModel(XTimespanModel):
         drop_dead_date_with_tzinfo = drop_dead_date.replace(
             tzinfo=get_current_timezone())
 
+        # A start that hasn't been saved and reloaded may still be naive.
+        # Interpret it as Django does when saving it, so the dates compare
+        # with those in the database.
+        start = self.start
+        if django_settings.USE_TZ and is_naive(start):
+            start = make_aware(start, get_default_timezone())
+
         # Yield rule's occurrence datetimes up until "drop dead" date(time)
-        rule = self.rule.get_rrule(dtstart=localtime(self.start))
+        rule = self.rule.get_rrule(dtstart=localtime(start))
         date_iter = iter(rule)
         while True:
             d = date_iter.next()
@@ -128,9 +277,9 @@ class GeneratorModel(XTimespanModel):
                 dddate = drop_dead_date
             if d > dddate:
                 break
-            yield d
+            if after is None or d > after:
+                yield d
     
-    @transaction.commit_on_success()
     def _update_existing_occurrences(self):
         """
         When you change a generator and save it, it updates existing occurrences
@@ -175,28 +324,58 @@ class GeneratorModel(XTimespanModel):
         # date to before the old start date. For now we'll just update the dates
         # and times.
 
-        saved_self = type(self).objects.get(pk=self.pk)
-        
-        start_shift = self.start - saved_self.start
-        duration_changed = self._duration != saved_self._duration
+        saved_state = self._saved_state
+        if saved_state['start'] is _UNKNOWN \
+                or saved_state['_duration'] is _UNKNOWN:
+            saved_state = type(self).objects.filter(pk=self.pk) \
+                .values('start', '_duration')[0]
+
+        # As in _generate_dates(), a start that hasn't been reloaded may
+        # still be naive.
+        start_shift = _make_aware(self.start) - \
+            _make_aware(saved_state['start'])
+        duration_changed = self._duration != saved_state['_duration']
 
         if start_shift or duration_changed:
-            # Update occurrences in opposite direction to the adjustment of the
-            # 'start' field, to avoid updating an occurrence to clash with an
-            # existing one's (event_id, start) DB uniqueness constraint (#606)
-            if start_shift.total_seconds() >= 0:
-                start_order_by = '-start'  # Moving to future, start from latest
-            else:
-                start_order_by = 'start'  # Moving to past, start from earliest
+            return self._shift_occurrences(start_shift, self._duration)
+        return 0
+
+    @transaction.commit_on_success()
+    def shift_occurrences(self, start_shift, duration):
+        """
+        Moves all my occurrences by the timedelta `start_shift`, and sets
+        their duration to `duration`, in a constant number of queries
+        (regardless of how many occurrences there are).
 
-            for o in self.occurrences.order_by(start_order_by):
-                o.start += start_shift
-                o._duration = self._duration
-                o.save()
+        Returns the number of occurrences updated.
+        """
+        return self._shift_occurrences(start_shift, duration)
+
+    def _shift_occurrences(self, start_shift, duration):
+        occurrences = self.occurrences.all()
+        if not start_shift:
+            return occurrences.update(_duration=duration)
+
+        # Updating every start in one statement could transiently clash with
+        # the (event_id, start) DB uniqueness constraint (#606), as rows are
+        # checked one at a time. So first park my occurrences after the last
+        # start of any occurrence, and after the last of their new starts,
+        # where nothing can clash, then shift them into place.
+        OccurrenceModel = self.occurrences.model
+        span = occurrences.aggregate(first=Min('start'), last=Max('start'))
+        if span['first'] is None:
+            return 0
+        last_start = OccurrenceModel._default_manager.aggregate(
+            last=Max('start'))['last']
+        park_after = max(last_start, span['last'] + start_shift)
+        park_shift = park_after - span['first'] + timedelta(days=1)
+
+        _shift_starts(occurrences, park_shift)
+        return _shift_starts(occurrences, start_shift - park_shift,
+            _duration=duration)
 
     
-    @transaction.commit_on_success()
-    def _sync_occurrences(self):
+    def _sync_occurrences(self, after=None):
     
         """
         Pass 2)
@@ -221,12 +400,46 @@ class GeneratorModel(XTimespanModel):
         The items remaining in list A are 'orphan' occurrences, that were
         previously generated, but would no longer be. These are unhooked from
         the generator.
+
+        This is done set-wise: the existing occurrences and exclusions are
+        loaded once and compared in memory with the candidates, then new
+        occurrences are bulk-created and orphans are deleted/unhooked in bulk.
+
+        If `after` is given, only candidates starting after it are considered,
+        and no occurrences are deleted or unhooked.
+
+        Returns the number of occurrences created.
         """
-        
-        all_occurrences = self.event.occurrences_in_listing().all() #regardless of generator
-        existing_but_not_regenerated = set(self.occurrences.all()) #generated by me only
+        event = self.event
+        OccurrenceModel = self.occurrences.model
 
-        for start in self._generate_dates():
+        all_occurrences = event.occurrences_in_listing() #regardless of generator
+        exclusions = event.ExclusionModel()._default_manager.filter(
+            event__in=event.get_descendants(include_self=True))
+        if after is not None:
+            all_occurrences = all_occurrences.filter(start__gt=after)
+            exclusions = exclusions.filter(start__gt=after)
+
+        # The first existing occurrence at each start (in the same order that
+        # occurrences_in_listing() gives).
+        existing = {}
+        for start, event_id, generated_by_id, pk in \
+            all_occurrences.values_list(
+                'start', 'event_id', 'generated_by_id', 'pk'):
+            existing.setdefault(start, (event_id, generated_by_id, pk))
+
+        # (event_id, start) of the exclusions of all events that occurrences
+        # in the listing could belong to.
+        excluded = set(exclusions.values_list('event_id', 'start'))
+
+        if after is None:
+            existing_but_not_regenerated = set(
+                self.occurrences.values_list('pk', flat=True)) #generated by me only
+        else:
+            existing_but_not_regenerated = set()
+        new_occurrences = []
+
+        for start in self._generate_dates(after=after):
             # if the proposed occurrence exists, then don't make a new one.
             # However, if it belongs to me: 
             #       and if it is marked as an exclusion:
@@ -234,43 +447,43 @@ class GeneratorModel(XTimespanModel):
             #       else:
             #           remove it from the set of existing_but_not_regenerated
             #           occurrences so it stays hooked up
-
-            try:
-                o = all_occurrences.filter(start=start)[0]
-                if o.generated_by == self:
-                    if not o.is_exclusion():
-                        existing_but_not_regenerated.discard(o)
+            if start in existing:
+                event_id, generated_by_id, pk = existing[start]
+                if generated_by_id == self.pk \
+                        and (event_id, start) not in excluded:
+                    existing_but_not_regenerated.discard(pk)
                 continue
-            except IndexError:
-                # no occurrence exists yet.
-                pass
 
             # if the proposed occurrence is an exclusion, don't save it.
-            if self.event.exclusions.filter(
-                event=self.event, start=start
-            ).count():
-                continue            
+            if (event.pk, start) in excluded:
+                continue
 
             #OK, we're good to create the occurrence.
-            o = self.occurrences.create(event=self.event, start=start, _duration=self._duration)
-#            print "created %s" % o
-            #implied generated_by = self
-    
+            new_occurrences.append(OccurrenceModel(
+                event=event, generated_by=self, start=start,
+                _duration=self._duration))
+            existing[start] = (event.pk, self.pk, None)
+
+        OccurrenceModel._default_manager.bulk_create(new_occurrences)
+
         # Finally, delete any unaccounted_for occurrences. If we can't delete, due to protection set by FKs to it, then
         # unhook it instead.
-        for o in existing_but_not_regenerated:
-#            print "deleting %s" % o
-            o.delete()
+        if existing_but_not_regenerated:
+            OccurrenceModel._default_manager.filter(
+                pk__in=existing_but_not_regenerated).delete_or_unhook()
+
+        return len(new_occurrences)
 
     def delete(self, *args, **kwargs):
         """
         If I am deleted, then cascade to my Occurrences, UNLESS there is is something FKed to them that is protecting them,
         in which case the FK is set to NULL.
         """
-        for o in self.occurrences.all():
-            o.delete()
+        event_ids = self._occurrence_event_ids()
+        self.occurrences.all().delete_or_unhook()
 
         super(GeneratorModel,self).delete(*args, **kwargs)
+        occurrences_changed.send(sender=self.EventModel(), event_ids=event_ids)
 
     def robot_description(self):
         r = "%s, repeating %s" % (
@@ -282,3 +495,32 @@ class GeneratorModel(XTimespanModel):
             r += " until %s" % pprint_date_span(self.repeat_until, self.repeat_until)
             
         return r
+
+
+def _shift_starts(occurrences, shift, **kwargs):
+    """
+    Adds the timedelta `shift` to the starts of the occurrences (and sets
+    any other fields given), in one query where the database can do the
+    date arithmetic. Returns the number of occurrences updated.
+    """
+    if not (django_settings.USE_TZ
+            and connections[occurrences.db].vendor == 'sqlite'):
+        return occurrences.update(start=F('start') + shift, **kwargs)
+
+    # Django's SQLite date arithmetic writes aware datetimes with a UTC
+    # offset, which then don't compare equal to other datetimes. So shift
+    # them one at a time.
+    manager = occurrences.model._default_manager
+    starts = list(occurrences.values_list('pk', 'start'))
+    for pk, start in starts:
+        manager.filter(pk=pk).update(start=start + shift, **kwargs)
+    return len(starts)
+
+def _make_aware(value):
+    """
+    Returns the datetime `value`, made aware in the default timezone if it's
+    naive and USE_TZ is on, as Django does when saving it.
+    """
+    if django_settings.USE_TZ and is_naive(value):
+        return make_aware(value, get_default_timezone())
+    return value
@@ -1,7 +1,7 @@
 from vobject.icalendar import utc
 
 from django.db import models
-from django.conf import settings
+from django.conf import settings as django_settings
 from django.core.exceptions import ValidationError
 from django.utils.safestring import mark_safe
 from django.core.urlresolvers import reverse
@@ -9,7 +9,8 @@ from django.db.models import signals
 from django.db.models.base import ModelBase
 from django.template.defaultfilters import urlencode
 from django.utils.dateformat import format
-from django.utils.timezone import make_aware, localtime
+from django.utils.timezone import get_default_timezone, is_naive, \
+    make_aware, localtime
 from django.utils.translation import ugettext as _
 from eventtools.models.xtimespan import XTimespanModel, XTimespanQSFN, XTimespanQuerySet, XTimespanManager
 from eventtools.conf import settings
@@ -18,6 +19,7 @@ from eventtools.utils import datetimeify, dayify
 from eventtools.utils.managertype import ManagerType
 
 import datetime
+from threading import local
 from dateutil.tz import gettz
 
 
@@ -59,6 +61,70 @@ class OccurrenceQSFN(XTimespanQSFN):
     def cancelled(self):
         return self.filter(status=settings.OCCURRENCE_STATUS_CANCELLED[0])
 
+    def delete_or_unhook(self):
+        """
+        Deletes the occurrences in this queryset, in bulk. Occurrences that
+        can't be deleted because something is FKed to them with
+        on_delete=PROTECT are unhooked from their generator (ie made one-off)
+        instead, as OccurrenceModel.delete() does for a single occurrence.
+
+        Returns a tuple of (number deleted, number unhooked).
+
+        The caller should send occurrences_changed for the occurrences'
+        events afterwards: while this runs, deleting_in_bulk() is True, so
+        that post_delete receivers can leave the work to that.
+        """
+        manager = self.model._default_manager
+        pks = set(self.values_list('pk', flat=True))
+        unhooked = set()
+
+        _bulk_delete.depth = getattr(_bulk_delete, 'depth', 0) + 1
+        try:
+            while pks:
+                qs = manager.filter(pk__in=pks)
+                try:
+                    qs.delete()
+                    break
+                except models.ProtectedError as e:
+                    protected = _protected_pks(self.model, e.protected_objects) & pks
+                    if not protected:
+                        # We can't tell which occurrences are protected, so
+                        # fall back to deleting them one at a time.
+                        for o in qs:
+                            o.delete()
+                        protected = set(qs.values_list('pk', flat=True))
+                    else:
+                        manager.filter(pk__in=protected).update(generated_by=None)
+                    unhooked |= protected
+                    pks -= protected
+        finally:
+            _bulk_delete.depth -= 1
+
+        return len(pks), len(unhooked)
+
+_bulk_delete = local()
+
+def deleting_in_bulk():
+    """
+    Returns True while OccurrenceQSFN.delete_or_unhook() is deleting
+    occurrences in this thread.
+    """
+    return getattr(_bulk_delete, 'depth', 0) > 0
+
+def _protected_pks(model, protected_objects):
+    """
+    Returns the pks of the instances of `model` that are referenced by
+    `protected_objects` (as given by a ProtectedError) through a protecting FK.
+    """
+    pks = set()
+    for obj in protected_objects:
+        for field in obj._meta.fields:
+            rel = getattr(field, 'rel', None)
+            if rel is not None and rel.on_delete is models.PROTECT \
+                    and issubclass(model, rel.to):
+                pks.add(getattr(obj, field.attname))
+    return pks
+
 class OccurrenceQuerySet(XTimespanQuerySet, OccurrenceQSFN):
     pass #all the goodness is inherited from OccurrenceQuerySetFN
 
@@ -93,6 +159,11 @@ class OccurrenceModel(XTimespanModel):
         ordering = ('start', 'event',)
         unique_together = ('start', 'event',)
 
+    def __init__(self, *args, **kwargs):
+        super(OccurrenceModel, self).__init__(*args, **kwargs)
+        # so that we can tell if the occurrence is moved to another event.
+        self._saved_event_id = self.__dict__.get('event_id')
+
     def __unicode__(self):
         return u"%s: %s" % (self.event, self.timespan_description())
 
@@ -104,11 +175,17 @@ class OccurrenceModel(XTimespanModel):
         return cls._meta.get_field('event').rel.to
 
     def is_exclusion(self):
-        qs = self.event.exclusions.filter(start=self.start)
-        if qs.count():
-            return True
-        return False
+        start = self.start
+        if django_settings.USE_TZ and is_naive(start):
+            start = make_aware(start, get_default_timezone())
+        return start in self.event.excluded_starts()
         
+    def save(self, *args, **kwargs):
+        r = super(OccurrenceModel, self).save(*args, **kwargs)
+        # after post_save, whose receivers may need the previous event
+        self._saved_event_id = self.event_id
+        return r
+
     def delete(self, *args, **kwargs):
         try:
             r = super(OccurrenceModel, self).delete(*args, **kwargs)
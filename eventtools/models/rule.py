@@ -4,6 +4,9 @@ from django.utils.translation import ugettext, ugettext_lazy as _
 from dateutil import rrule
 from dateutil.relativedelta import weekdays
 
+from eventtools.conf import settings
+from eventtools.utils.lru import LRUCache
+
 freqs = (
     ("YEARLY", _("Yearly")),
     ("MONTHLY", _("Monthly")),
@@ -11,6 +14,21 @@ freqs = (
     ("DAILY", _("Daily")),
 )
 
+FREQUENCIES = {
+    "YEARLY": rrule.YEARLY,
+    "MONTHLY": rrule.MONTHLY,
+    "WEEKLY": rrule.WEEKLY,
+    "DAILY": rrule.DAILY,
+    "HOURLY": rrule.HOURLY,
+    "MINUTELY": rrule.MINUTELY,
+    "SECONDLY": rrule.SECONDLY,
+}
+
+# Compiled rrules, keyed by (rule pk, rule version, dtstart), and parsed
+# params, keyed by (rule pk, params).
+_rrule_cache = LRUCache(settings.RULE_CACHE_SIZE)
+_params_cache = LRUCache(settings.RULE_CACHE_SIZE)
+
 class Rule(models.Model):
     """
     This defines a rule by which an occurrence will repeat. Parameters
@@ -65,12 +83,45 @@ class Rule(models.Model):
         ordering = ('-common', 'name')
         app_label = "eventtools"
 
+    def save(self, *args, **kwargs):
+        r = super(Rule, self).save(*args, **kwargs)
+        self.invalidate_cache()
+        return r
+
+    def delete(self, *args, **kwargs):
+        self.invalidate_cache()
+        return super(Rule, self).delete(*args, **kwargs)
+
+    def invalidate_cache(self):
+        """
+        Discards the compiled rrules and parsed params cached for this rule.
+        """
+        pk = self.pk
+        _rrule_cache.delete_where(lambda key: key[0] == pk)
+        _params_cache.delete_where(lambda key: key[0] == pk)
+
+    def version(self):
+        """
+        The values that determine the rrules this rule compiles to. Cached
+        rrules are keyed on this as well as the pk, so that a rule that has
+        changed in another process is never served stale.
+        """
+        return (self.frequency, self.params, self.complex_rule)
+
     def get_params(self):
         """
         >>> rule = Rule(params = "count:1;bysecond:1;byminute:1,2,4,5")
         >>> rule.get_params()
         {'count': 1, 'byminute': [1, 2, 4, 5], 'bysecond': 1}
         """
+        key = (self.pk, self.params)
+        params = _params_cache.get(key)
+        if params is None:
+            params = self._parse_params()
+            _params_cache.set(key, params)
+        return dict(params)
+
+    def _parse_params(self):
         params = self.params
         if params is None:
             return {}
@@ -90,6 +141,23 @@ class Rule(models.Model):
         return self.name or unicode(self.frequency).lower()
     
     def get_rrule(self, dtstart):
+        """
+        Returns the rrule (an rruleset, or an rrule if complex_rule is used)
+        for this rule, starting at `dtstart`.
+
+        Compiled rrules are cached, so the returned object is shared and
+        should be iterated over, but not modified.
+        """
+        # datetimes that are equal may still have different timezones, which
+        # give different rrules.
+        key = (self.pk, self.version(), dtstart, dtstart.tzinfo)
+        compiled = _rrule_cache.get(key)
+        if compiled is None:
+            compiled = self._compile_rrule(dtstart)
+            _rrule_cache.set(key, compiled)
+        return compiled
+
+    def _compile_rrule(self, dtstart):
         if self.complex_rule:
             d = dtstart.date()
             weekday = weekdays[d.weekday()]
@@ -113,8 +181,11 @@ class Rule(models.Model):
             except ValueError: # eg. unsupported property 
                 pass
         params = self.get_params()
-        frequency = 'rrule.%s' % self.frequency
-        simple_rule = rrule.rrule(eval(frequency), dtstart=dtstart, **params)
+        try:
+            frequency = FREQUENCIES[self.frequency]
+        except KeyError:
+            raise ValueError("Unknown frequency %r" % self.frequency)
+        simple_rule = rrule.rrule(frequency, dtstart=dtstart, **params)
         rs = rrule.rruleset()
         rs.rrule(simple_rule)
         return rs
@@ -0,0 +1,271 @@
+from datetime import timedelta
+
+from django.conf import settings as django_settings
+from django.db import connections, models
+from django.db.models import Count, Max, Min
+from django.db.models.signals import class_prepared, post_save, post_delete
+from django.dispatch import receiver
+from django.utils.timezone import is_naive, localtime, make_aware, now, utc
+from django.utils.translation import ugettext_lazy as _
+
+from eventtools.conf import settings
+from eventtools.models.occurrence import OccurrenceModel, deleting_in_bulk
+from eventtools.signals import occurrences_changed
+
+
+class OccurrenceSummaryMixin(object):
+    """
+    The status methods of an occurrence summary, shared by EventSummaryModel
+    and ListingSummary.
+    """
+
+    def is_finished(self):
+        if self.closing_end is not None:
+            return self.closing_end < now()
+
+    def is_cancelled(self):
+        return self.cancelled_count > 0 \
+            and self.occurrence_count == self.cancelled_count
+
+    def forthcoming_is_cancelled(self):
+        t = now()
+        return _on_or_after(self.last_cancelled_start, t) \
+            and not _on_or_after(self.last_uncancelled_start, t)
+
+    def is_fully_booked(self):
+        return self.available_count == 0 and self.fully_booked_count > 0
+
+    def forthcoming_is_fully_booked(self):
+        t = now()
+        return not _on_or_after(self.last_available_start, t) \
+            and _on_or_after(self.last_fully_booked_start, t)
+
+    def is_available(self):
+        return self.available_count > 0
+
+
+class EventSummaryModel(OccurrenceSummaryMixin, models.Model):
+    """
+    An optional, denormalised summary of the occurrences in listing of an
+    event, so that season(), status(), is_cancelled() etc. don't need to
+    query the occurrences.
+
+    To enable summaries, define a subclass with an 'event' OneToOneField to
+    your EventModel subclass. The related_name for the field should be
+    'occurrence_summary'.
+
+        event = models.OneToOneField(SomeEvent, related_name="occurrence_summary")
+
+    Summaries are kept up to date when occurrences are saved or deleted, when
+    generators are saved, extended or deleted, and when events are moved to
+    another parent. If you change occurrences
+    with queryset.update(), send eventtools.signals.occurrences_changed, or
+    run the rebuild_event_summaries command.
+    """
+    occurrence_count = models.PositiveIntegerField(default=0)
+    available_count = models.PositiveIntegerField(default=0)
+    cancelled_count = models.PositiveIntegerField(default=0)
+    fully_booked_count = models.PositiveIntegerField(default=0)
+
+    first_start = models.DateTimeField(blank=True, null=True)
+    last_start = models.DateTimeField(blank=True, null=True)
+    closing_end = models.DateTimeField(blank=True, null=True,
+        help_text=_("when the closing occurrence ends"))
+
+    # The latest start of each kind of occurrence. Comparing these with now
+    # tells us whether there are any forthcoming occurrences of that kind.
+    last_available_start = models.DateTimeField(blank=True, null=True)
+    last_cancelled_start = models.DateTimeField(blank=True, null=True)
+    last_uncancelled_start = models.DateTimeField(blank=True, null=True)
+    last_fully_booked_start = models.DateTimeField(blank=True, null=True)
+
+    status_count = models.PositiveIntegerField(default=0,
+        help_text=_("how many different statuses the occurrences have"))
+    status = models.CharField(max_length=20, blank=True, null=True,
+        help_text=_("the status of all occurrences, if they have the same one"))
+    start_time = models.TimeField(blank=True, null=True,
+        help_text=_("the local start time of the event's own occurrences, if they all start at the same time"))
+
+    class Meta:
+        abstract = True
+
+    def __unicode__(self):
+        return u"Summary of %s" % self.event
+
+    @classmethod
+    def summarise(cls, event):
+        """
+        Returns a dictionary of summary field values for the given event.
+        """
+        cancelled = settings.OCCURRENCE_STATUS_CANCELLED[0]
+        fully_booked = settings.OCCURRENCE_STATUS_FULLY_BOOKED[0]
+
+        values = dict(
+            occurrence_count=0, available_count=0, cancelled_count=0,
+            fully_booked_count=0, first_start=None, last_start=None,
+            closing_end=None, last_available_start=None,
+            last_cancelled_start=None, last_uncancelled_start=None,
+            last_fully_booked_start=None, status_count=0, status=None,
+            start_time=None,
+        )
+
+        def latest(field, start):
+            if values[field] is None or start > values[field]:
+                values[field] = start
+
+        # order_by() stops the default ordering being added to the GROUP BY
+        by_status = event.occurrences_in_listing().order_by() \
+            .values('status') \
+            .annotate(count=Count('pk'), first=Min('start'), last=Max('start'))
+
+        statuses = set()
+        for row in by_status:
+            status, count, last = row['status'] or "", row['count'], row['last']
+            statuses.add(status)
+            values['occurrence_count'] += count
+            if values['first_start'] is None or row['first'] < values['first_start']:
+                values['first_start'] = row['first']
+            latest('last_start', last)
+
+            if status in ("", None):
+                values['available_count'] += count
+                latest('last_available_start', last)
+            if status == cancelled:
+                values['cancelled_count'] += count
+                latest('last_cancelled_start', last)
+            else:
+                latest('last_uncancelled_start', last)
+            if status == fully_booked:
+                values['fully_booked_count'] += count
+                latest('last_fully_booked_start', last)
+
+        values['status_count'] = len(statuses)
+        if len(statuses) == 1:
+            values['status'] = list(statuses)[0]
+
+        if values['occurrence_count']:
+            values['closing_end'] = event.closing_occurrence().end()
+
+        # stop as soon as we find a second start time.
+        start_times = set()
+        for start in event.occurrences.order_by() \
+                .values_list('start', flat=True).distinct().iterator():
+            start_times.add(localtime(start).time())
+            if len(start_times) > 1:
+                break
+        if len(start_times) == 1:
+            values['start_time'] = list(start_times)[0]
+
+        return values
+
+    @classmethod
+    def refresh(cls, event, create=True):
+        """
+        Recalculates the summary of the given event. If the event doesn't
+        have a summary yet, one is created, unless create is False.
+        """
+        values = cls.summarise(event)
+        updated = cls._default_manager.filter(event=event).update(**values)
+        if not updated and create:
+            cls._default_manager.create(event=event, **values)
+
+
+class ListingSummary(OccurrenceSummaryMixin):
+    """
+    An occurrence summary read from the annotations added by
+    EventQuerySet.with_listing_summary(). It has the same fields as
+    EventSummaryModel, except start_time.
+    """
+    COUNT_FIELDS = ('occurrence_count', 'available_count', 'cancelled_count',
+        'fully_booked_count', 'status_count')
+    START_FIELDS = ('first_start', 'last_start', 'last_available_start',
+        'last_cancelled_start', 'last_uncancelled_start',
+        'last_fully_booked_start')
+
+    def __init__(self, event):
+        # The annotations are raw column values, so convert them as Django
+        # does for aggregates (eg. SQLite returns strings for datetimes).
+        ops = connections[event._state.db or 'default'].ops
+        start_field = event.OccurrenceModel()._meta.get_field('start')
+
+        for name in self.COUNT_FIELDS:
+            setattr(self, name, int(getattr(event, 'listing_' + name) or 0))
+        for name in self.START_FIELDS:
+            value = getattr(event, 'listing_' + name)
+            if value is not None:
+                value = ops.convert_values(value, start_field)
+                if django_settings.USE_TZ and is_naive(value):
+                    value = make_aware(value, utc)
+            setattr(self, name, value)
+        self.status = event.listing_status
+
+        self.closing_end = None
+        if self.last_start is not None:
+            duration = int(event.listing_closing_duration or 0)
+            self.closing_end = self.last_start + timedelta(minutes=duration)
+
+
+def _on_or_after(start, t):
+    # forthcoming() includes occurrences starting now.
+    return start is not None and start >= t
+
+
+def refresh_summaries(EventModel, event_ids, create=True):
+    """
+    Refreshes the summaries of the given events and their ancestors (whose
+    occurrences in listing include those of their descendants), if
+    summaries are enabled for EventModel.
+    """
+    SummaryModel = EventModel.SummaryModel()
+    event_ids = set(event_ids) - set([None])
+    if SummaryModel is None or not event_ids:
+        return
+
+    events = {}
+    for event in EventModel._event_manager.filter(pk__in=event_ids):
+        for e in event.get_ancestors(include_self=True):
+            events[e.pk] = e
+    for event in events.values():
+        SummaryModel.refresh(event, create=create)
+
+
+def _occurrence_saved(sender, instance, **kwargs):
+    # the occurrence may have been moved from another event
+    refresh_summaries(sender.EventModel(),
+        [instance.event_id, instance._saved_event_id])
+
+
+def _occurrence_deleted(sender, instance, **kwargs):
+    # Occurrences deleted in bulk are refreshed once, by occurrences_changed.
+    if deleting_in_bulk():
+        return
+    # Don't create summaries here: if the event is being deleted too, its
+    # summary may already have gone.
+    refresh_summaries(sender.EventModel(),
+        [instance.event_id, instance._saved_event_id], create=False)
+
+
+def _event_saved(sender, instance, created, **kwargs):
+    if created:
+        return
+    # a moved event's occurrences leave its old ancestors' listings, and join
+    # its new ancestors'.
+    if instance.parent_id != instance._saved_parent_id:
+        refresh_summaries(sender, [instance.pk, instance._saved_parent_id])
+
+
+@receiver(class_prepared)
+def _connect(sender, **kwargs):
+    # Connect to each occurrence and event model, rather than checking the
+    # sender of every save and delete.
+    from eventtools.models.event import EventModel
+    if issubclass(sender, OccurrenceModel):
+        post_save.connect(_occurrence_saved, sender=sender)
+        post_delete.connect(_occurrence_deleted, sender=sender)
+    elif issubclass(sender, EventModel):
+        post_save.connect(_event_saved, sender=sender)
+
+
+@receiver(occurrences_changed)
+def _occurrences_changed(sender, event_ids, **kwargs):
+    refresh_summaries(sender, event_ids)
@@ -1,14 +1,15 @@
 import datetime
+from collections import namedtuple
 
 from django.db import models
 from django.utils.translation import ugettext as _
 from eventtools.utils import datetimeify
-from eventtools.utils.datetimeify import dayify
+from eventtools.utils.datetimeify import local_day_bounds
 from eventtools.utils.managertype import ManagerType
 from eventtools.utils.pprint_timespan import pprint_datetime_span, pprint_time_span
 from django.utils.safestring import mark_safe
 from django.utils.timezone import now, localtime, make_aware, \
-    get_default_timezone, is_naive
+    get_default_timezone, is_aware, is_naive
 
 class XTimespanQSFN(object):
     """
@@ -33,8 +34,10 @@ class XTimespanQSFN(object):
         return self.starts_after(d1).starts_before(d2)
 
     def starts_on(self, day):
-        d1, d2 = dayify(day)
-        return self.starts_between(d1, d2)
+        """
+        returns the occurrences that start on a given (local) day.
+        """
+        return self.filter(start__range=local_day_bounds(day))
 
     #defaults - implementers may wish to override with other kinds of queries
     before = starts_before
@@ -42,6 +45,28 @@ class XTimespanQSFN(object):
     between = starts_between
     on = starts_on
 
+    def start_dates(self):
+        """
+        Returns the set of (local) dates on which the occurrences start.
+        Only the distinct start times are fetched, since Django can't
+        truncate them to dates in the current timezone in the database.
+        """
+        dates = set()
+        for start in self.order_by().values_list('start', flat=True) \
+                .distinct().iterator():
+            if is_aware(start):
+                start = localtime(start)
+            dates.add(start.date())
+        return dates
+
+    def by_start_date(self):
+        """
+        Returns a list of (local date, [occurrences]) for the days on which
+        the occurrences start, in order. The occurrences should be ordered
+        by start.
+        """
+        return group_by_start_date(self)
+
     #misc queries (note they assume starts_)
     def forthcoming(self):
         return self.starts_after(now())
@@ -49,6 +74,23 @@ class XTimespanQSFN(object):
     def recent(self):
         return self.starts_before(now())
 
+# (local date, [occurrences]), which templates can also use like the groups
+# of {% regroup %}, as day.grouper and day.list
+DayGroup = namedtuple('DayGroup', 'grouper list')
+
+def group_by_start_date(occurrences):
+    """
+    Groups an iterable of occurrences, ordered by start, into a list of
+    DayGroup(local date, [occurrences]).
+    """
+    groups = []
+    for occurrence in occurrences:
+        day = occurrence.start_date()
+        if not groups or groups[-1][0] != day:
+            groups.append(DayGroup(day, []))
+        groups[-1][1].append(occurrence)
+    return groups
+
 class XTimespanQuerySet(models.query.QuerySet, XTimespanQSFN):
     pass #all the goodness is inherited from XTimespanQSFN
 
@@ -196,7 +238,7 @@ class XTimespanModel(models.Model):
 
     def start_date(self):
         """Used for regrouping in template"""
-        return self.start.date()
+        return localtime(self.start).date()
 
     def humanised_day(self):
         if self.start.date() == now().date():
@@ -14,14 +14,24 @@ EVENT_GET_MAP = {
 }
 
 OCCURRENCES_PER_PAGE = 20
+OCCURRENCES_COUNT_LIMIT = 200 # only count occurrence listings up to this many (None to count them all)
 
 ICAL_ROOT_URL = getattr(settings, 'ICS_ROOT_URL', 'http://www.example.com')
 ICAL_CALNAME = getattr(settings, 'SITE_NAME', 'Events list')
 ICAL_CALDESC = "Events listing" #e.g. "Events listing from mysite.com"
+ICAL_CACHE_TIMEOUT = 60 * 60 # seconds to keep feed versions and serialised feeds in Django's cache
+ICAL_CACHE_MAX_SIZE = 1024 * 1024 # don't cache serialised feeds bigger than this many bytes (0 to never cache them)
 
 from dateutil.relativedelta import relativedelta
 DEFAULT_GENERATOR_LIMIT = relativedelta(years=1) #months=6, etc
 
+RULE_CACHE_SIZE = 256 # how many compiled rrules to keep in memory
+
+NAV_CALENDARS_MAX_MONTHS = 12 # the most months that nav_calendars shows (0 for no limit)
+CALENDAR_CACHE_SIZE = 128 # how many decorated and rendered calendar months to keep in memory (0 to not cache them)
+CALENDAR_CACHE_BACKEND = None # the name of a Django cache to keep calendar months in instead, eg. 'default'
+CALENDAR_CACHE_TIMEOUT = 60 * 60 * 24 # seconds to keep calendar months in CALENDAR_CACHE_BACKEND
+
 OCCURRENCE_STATUS_CANCELLED =  ('cancelled', 'Cancelled')
 OCCURRENCE_STATUS_FULLY_BOOKED = ('fully booked', 'Fully Booked')
 
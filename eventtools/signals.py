@@ -0,0 +1,9 @@
+from django.dispatch import Signal
+
+# Sent when occurrences have been created, changed or removed other than by
+# saving or deleting them one at a time, eg. by a generator, or in bulk
+# (bulk_create and update() don't send post_save).
+#
+# sender is the Event model, and event_ids is the set of pks of the events
+# whose own occurrences have changed.
+occurrences_changed = Signal(providing_args=['event_ids'])
@@ -7,15 +7,26 @@ if not pycal:
 import datetime
 from dateutil.relativedelta import *
 from django import template
-from django.template.context import RequestContext
+from django.template.context import Context, RequestContext
 from django.template import TemplateSyntaxError
-from django.core.urlresolvers import reverse
+from django.core.urlresolvers import get_script_prefix, get_urlconf, reverse
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from django.utils.timezone import is_aware, localtime
+from django.utils.translation import get_language
 
 from eventtools.conf import settings as eventtools_settings
 from eventtools.models import EventModel, OccurrenceModel
+from eventtools.utils.calendarcache import dates_digest, get_calendar_cache
+from eventtools.utils.lru import LRUCache
 
 register = template.Library()
 
+# Decorated months and rendered calendars. The date functions made by the
+# factories below have a cache_key saying what their results depend on;
+# months using other functions aren't cached.
+_calendar_cache = get_calendar_cache()
+
 def DATE_HREF_FACTORY(test_dates=True, dates=[]):
     """
     If test_dates is True, then URLs will only be returned if the day is in the
@@ -23,6 +34,7 @@ def DATE_HREF_FACTORY(test_dates=True, dates=[]):
     
     If test_dates is False, URLs are always returned.
     """
+    dates = frozenset(dates)
     def f(day):
         """
         Given a day, return a URL to navigate to.
@@ -34,9 +46,11 @@ def DATE_HREF_FACTORY(test_dates=True, dates=[]):
                 day.day,
             ))
         return None
+    f.cache_key = ('href', test_dates, test_dates and dates_digest(dates) or '')
     return f
 
 def DATE_CLASS_HIGHLIGHT_FACTORY(dates, selected_day):
+    dates = frozenset(dates)
     def f(day):
         r = set()
         if day == selected_day:
@@ -44,24 +58,123 @@ def DATE_CLASS_HIGHLIGHT_FACTORY(dates, selected_day):
         if day in dates:
             r.add('highlight')
         return r
+    f.cache_key = ('highlight', dates_digest(dates), repr(selected_day))
     return f
 
 class DecoratedDate(object):
     """
     A wrapper for date that has some css classes and a link, to use in rendering
     that date in a calendar.
+
+    DecoratedDates are immutable, and their classes are a frozenset shared
+    with every other DecoratedDate that has the same classes, so that the
+    (many) dates of cached months take little memory.
     """
-    def __init__(self, date, href=None, classes=[], data=""):
-        self.date = date
-        self.href = href
-        self.classes = classes
-        self.data = data
-    
+    __slots__ = ('date', 'href', 'classes', 'data')
+
+    def __init__(self, date, href=None, classes=(), data=""):
+        set_attr = super(DecoratedDate, self).__setattr__
+        set_attr('date', date)
+        set_attr('href', href)
+        set_attr('classes', intern_classes(classes))
+        set_attr('data', data)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("DecoratedDate is immutable")
+
+    __delattr__ = __setattr__
+
+    def __reduce__(self):
+        # pickle (eg. for CALENDAR_CACHE_BACKEND) can't set immutable slots
+        return (DecoratedDate, (self.date, self.href, self.classes, self.data))
+
     def __unicode__(self):
         if self.href:
             return "%s (%s)" % (self.date, self.href)
         return unicode(self.date)
-                
+
+# The distinct frozensets of classes in use, so that equal ones are shared.
+# Bounded, in case a date_class_fn makes endless combinations.
+_class_sets = {}
+MAX_CLASS_SETS = 1024
+
+def intern_classes(classes):
+    """
+    Returns a frozenset of classes, which is the same object for equal sets.
+    """
+    classes = frozenset(classes)
+    interned = _class_sets.get(classes)
+    if interned is None:
+        if len(_class_sets) >= MAX_CLASS_SETS:
+            return classes
+        interned = _class_sets.setdefault(classes, classes)
+    return interned
+
+def _month_day(day=None):
+    """
+    Returns the date defining the month to show in a calendar, given a date,
+    an occurrence, a list of either, or None for today.
+    """
+    if day is None:
+        return datetime.date.today()
+    try:
+        day = day[0]
+    except TypeError:
+        pass
+    if isinstance(day, OccurrenceModel):
+        day = day.start.date()
+    return day
+
+def _month_weeks(day):
+    """
+    Returns the weeks shown in a calendar of the month of day, as full weeks.
+    Weeks are lists of seven dates.
+    """
+    cal = pycal.Calendar(eventtools_settings.FIRST_DAY_OF_WEEK)
+    return cal.monthdatescalendar(day.year, day.month)
+
+_month_templates = LRUCache(64)
+
+def _month_template(day):
+    """
+    Returns the weeks of the calendar of the month of day, as lists of
+    (date, classes, data) with the classes that don't depend on the date
+    functions: the day of the week, and 'last_month' and 'next_month' for
+    leading and trailing days.
+    """
+    key = (day.year, day.month, eventtools_settings.FIRST_DAY_OF_WEEK)
+    weeks = _month_templates.get(key)
+    if weeks is None:
+        weeks = []
+        for week in _month_weeks(day):
+            template_week = []
+            for wday in week:
+                #day of the week class
+                classes = [wday.strftime('%A').lower()]
+                if wday.month != day.month:
+                    if wday < day:
+                        classes.append('last_month')
+                    else:
+                        classes.append('next_month')
+                #ISO class
+                template_week.append(
+                    (wday, intern_classes(classes), wday.isoformat()))
+            weeks.append(template_week)
+        _month_templates.set(key, weeks)
+    return weeks
+
+def _start_dates(occurrences, first, last):
+    """
+    Returns the set of dates from first to last on which the given
+    occurrences (a queryset or iterable) start.
+    """
+    if occurrences is None:
+        return set()
+    if hasattr(occurrences, 'starts_between'):
+        return occurrences.starts_between(first, last).start_dates()
+    dates = set(o.start_date() for o in occurrences)
+    return set(d for d in dates if first <= d <= last)
+
 def calendar(
         context, day=None,
         date_class_fn=None,
@@ -99,6 +212,45 @@ def calendar(
 
     """
     
+    today = datetime.date.today()
+    day = _month_day(day)
+
+    key = _month_cache_key(day, today,
+        date_class_fn, date_href_fn, month_href_fn)
+    month = None
+    if key is not None:
+        month = _calendar_cache.get(('month',) + key)
+    if month is None:
+        month = _decorate_month(day, today,
+            date_class_fn, date_href_fn, month_href_fn)
+        if key is not None:
+            _calendar_cache.set(('month',) + key, month)
+
+    context.update(dict(month, calendar_cache_key=key))
+    return context
+
+def _month_cache_key(day, today, *fns):
+    """
+    Returns the key of the decorated month of day, or None if it can't be
+    cached because one of the date functions doesn't have a cache_key.
+    """
+    fn_keys = []
+    for fn in fns:
+        if fn is None:
+            fn_keys.append(None)
+        elif hasattr(fn, 'cache_key'):
+            fn_keys.append(fn.cache_key)
+        else:
+            return None
+    # hrefs depend on the URLconf
+    return (day.year, day.month, eventtools_settings.FIRST_DAY_OF_WEEK,
+        today, get_urlconf(), get_script_prefix()) + tuple(fn_keys)
+
+def _decorate_month(day, today, date_class_fn, date_href_fn, month_href_fn):
+    """
+    Returns the weeks of DecoratedDates, and the previous and next months,
+    shown by calendar().
+    """
     if date_class_fn is None:
         date_class_fn = lambda x: set()
         
@@ -107,42 +259,20 @@ def calendar(
 
     if month_href_fn is None:
         month_href_fn = lambda x: None
-    
-    today = datetime.date.today()
-
-    if day is None:
-        day = today
-    else:
-        try:
-            day = day[0]
-        except TypeError:
-            pass
-        
-    if isinstance(day, OccurrenceModel):
-        day = day.start.date()
 
-    cal = pycal.Calendar(eventtools_settings.FIRST_DAY_OF_WEEK)
-    # cal is a list of the weeks in the month of the year as full weeks. 
-    # Weeks are lists of seven dates
-    weeks = cal.monthdatescalendar(day.year, day.month)
-    
     # Transform into decorated dates
     decorated_weeks = []
-    for week in weeks:
+    for week in _month_template(day):
         decorated_week = []
-        for wday in week:
-            classes = set(date_class_fn(wday))
-            if wday == today:
-                classes.add('today')
-            if wday.month != day.month:
-                if wday < day:
-                    classes.add('last_month')
-                if wday > day:
-                    classes.add('next_month')
-            #day of the week class
-            classes.add(wday.strftime('%A').lower())
-            #ISO class
-            data = wday.isoformat()
+        for wday, base_classes, data in week:
+            classes = date_class_fn(wday)
+            if classes or wday == today:
+                classes = set(classes)
+                classes.update(base_classes)
+                if wday == today:
+                    classes.add('today')
+            else:
+                classes = base_classes
             
             decorated_week.append(
                 DecoratedDate(
@@ -164,13 +294,11 @@ def calendar(
     )
 
 
-    context.update({
+    return {
         'weeks': decorated_weeks,
         'prev_month': decorated_prev_date,
         'next_month': decorated_next_date,
-    })
-    
-    return context
+    }
 
 
 def nav_calendar(
@@ -182,13 +310,13 @@ def nav_calendar(
     """
     Renders a nav calendar for a date, and an optional occurrence_qs.
     Dates in the occurrence_qs are given the class 'highlight'.
+
+    Only the dates of the occurrences in the displayed weeks are fetched.
     """
     
     #TODO: allow dates, not just occurrence_qs
-    if occurrence_qs:
-        occurrence_days = [o.start.date() for o in occurrence_qs]
-    else:
-        occurrence_days = []
+    weeks = _month_weeks(_month_day(date))
+    occurrence_days = _start_dates(occurrence_qs, weeks[0][0], weeks[-1][-1])
     
     if date_href_fn is None:
         date_href_fn = DATE_HREF_FACTORY(dates=occurrence_days)
@@ -210,36 +338,49 @@ def nav_calendars(
         context, occurrence_qs=[], selected_occurrence=None,
         date_href_fn=None,
         date_class_fn=None,
+        max_months=None,
     ):
     """
     Renders several calendars, so as to encompass all dates in occurrence_qs.
     These will be folded up into a usable widget with javascript.
+
+    At most max_months (by default NAV_CALENDARS_MAX_MONTHS) calendars are
+    shown, from the month of selected_occurrence if it's given, or else from
+    the month of the first occurrence.
     """
-    
+    if max_months is None:
+        max_months = eventtools_settings.NAV_CALENDARS_MAX_MONTHS
+
+    selected_day = None
+    from_month = None
+    if selected_occurrence:
+        selected_day = _local_date(selected_occurrence.start)
+        from_month = selected_day.replace(day=1)
+
     #TODO: allow dates, not just occurrence_qs
-    if date_class_fn is None and occurrence_qs:
-        occurrence_days = [o.start.date() for o in occurrence_qs]
-        if selected_occurrence:
-            date_class_fn = DATE_CLASS_HIGHLIGHT_FACTORY(occurrence_days, selected_occurrence.start.date())
-        else:
-            date_class_fn = DATE_CLASS_HIGHLIGHT_FACTORY(occurrence_days, None)
+    dates_by_month = _start_dates_by_month(
+        occurrence_qs, from_month, max_months)
 
+    if dates_by_month:
+        month = min(dates_by_month)
+        last_month = max(dates_by_month)
+    else:
+        month = last_month = datetime.date.today().replace(day=1)
 
     calendars = []
-    if occurrence_qs.count() > 0:
-        first_date = occurrence_qs[0].start.date()
-        last_date = occurrence_qs.reverse()[0].start.date()
-    else:
-        first_date = last_date = datetime.date.today()
-    first_month = datetime.date(first_date.year, first_date.month, 1)
-    month = first_month
-    
-    while month <= last_date:
+    while month <= last_month:
+        # a calendar's leading and trailing days are in the months either side
+        month_dates = set()
+        for m in (month + relativedelta(months=-1), month,
+                month + relativedelta(months=+1)):
+            month_dates |= dates_by_month.get(m, set())
+        month_class_fn = date_class_fn or DATE_CLASS_HIGHLIGHT_FACTORY(
+            month_dates, selected_day)
         calendars.append(
              calendar(
                 {}, day=month, 
                 date_href_fn=date_href_fn,
-                date_class_fn=date_class_fn,
+                date_class_fn=month_class_fn,
             )
         )
         month += relativedelta(months=+1)
@@ -250,6 +391,85 @@ def nav_calendars(
     })
     return context
 
-register.inclusion_tag("eventtools/calendar/calendar.html", takes_context=True)(calendar)
-register.inclusion_tag("eventtools/calendar/calendar.html", takes_context=True)(nav_calendar)
+def _local_date(dt):
+    if is_aware(dt):
+        dt = localtime(dt)
+    return dt.date()
+
+def _start_dates_by_month(occurrences, from_month=None, max_months=None):
+    """
+    Returns a dictionary of {first day of the month: set of dates}, of the
+    dates on which the given occurrences (a queryset or iterable) start,
+    from from_month (or the first occurrence) for at most max_months.
+
+    Only the distinct start times are fetched, in one query, and only as
+    many of them are read as are needed.
+    """
+    if not hasattr(occurrences, '__iter__'): # eg. a missing template variable
+        return {}
+    if hasattr(occurrences, 'values_list'):
+        if from_month is not None:
+            occurrences = occurrences.starts_after(from_month)
+        starts = occurrences.order_by('start') \
+            .values_list('start', flat=True).distinct().iterator()
+    else:
+        starts = sorted(o.start for o in occurrences)
+
+    dates_by_month = {}
+    end_month = None
+    for start in starts:
+        day = _local_date(start)
+        month = day.replace(day=1)
+        if from_month is not None and month < from_month:
+            continue
+        if end_month is None and max_months:
+            end_month = month + relativedelta(months=+max_months)
+        if end_month is not None and month >= end_month:
+            break
+        dates_by_month.setdefault(month, set()).add(day)
+    return dates_by_month
+
+def cached_inclusion_tag(template_name, fn):
+    """
+    Registers fn as a tag, like register.inclusion_tag(template_name,
+    takes_context=True), but caches the rendered template under the
+    calendar_cache_key fn puts in the context, unless it's None.
+
+    The template is rendered with only the values fn puts in the context,
+    not the rest of the page's context, so the cached HTML can't depend on
+    anything the key doesn't cover.
+    """
+    def tag(context, *args, **kwargs):
+        depth = len(context.dicts)
+        context.push()
+        try:
+            fn(context, *args, **kwargs)
+            values = {}
+            for d in context.dicts[depth:]:
+                values.update(d)
+        finally:
+            del context.dicts[depth:]
+
+        key = values.get('calendar_cache_key')
+        if key is not None:
+            key = ('html', template_name, get_language()) + key
+            html = _calendar_cache.get(key)
+            if html is not None:
+                return html
+        html = mark_safe(render_to_string(template_name,
+            context_instance=Context(values,
+                autoescape=context.autoescape,
+                current_app=context.current_app,
+                use_l10n=context.use_l10n,
+                use_tz=context.use_tz,
+            )))
+        if key is not None:
+            _calendar_cache.set(key, html)
+        return html
+    tag.__name__ = fn.__name__
+    tag.__doc__ = fn.__doc__
+    register.simple_tag(takes_context=True, name=fn.__name__)(tag)
+
+cached_inclusion_tag("eventtools/calendar/calendar.html", calendar)
+cached_inclusion_tag("eventtools/calendar/calendar.html", nav_calendar)
 register.inclusion_tag("eventtools/calendar/calendars.html", takes_context=True)(nav_calendars)
\ No newline at end of file
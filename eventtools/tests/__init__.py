@@ -1,3 +1,6 @@
 from models import *
 from utils import *
-from views import *
\ No newline at end of file
+from views import *
+from eventviews import *
+from templatetags import *
+from admin import *
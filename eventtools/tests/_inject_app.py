@@ -2,7 +2,7 @@ import shlex
 import subprocess
 from random import randint
 
-from django.db.models.loading import load_app
+from django.db.models.loading import cache as app_cache, load_app
 from django.conf import settings
 from django.core.management import call_command
 from django.template.loaders import app_directories
@@ -28,6 +28,8 @@ class TestCaseWithApp(TestCase):
         self._old_root_urlconf = settings.ROOT_URLCONF
         settings.ROOT_URLCONF = '%s.urls' % APP_NAME
         load_app(APP_NAME)
+        # get_models() caches its results, which may predate the app.
+        app_cache._get_models_cache.clear()
         call_command('flush', verbosity=0, interactive=False)
         call_command('syncdb', verbosity=0, interactive=False)
         self.ae = self.assertEqual
@@ -55,4 +57,21 @@ class TestCaseWithApp(TestCase):
         f = open(filename, "w")
         f.write(s)
         f.close()
-        subprocess.call(shlex.split("google-chrome %s" % filename))
\ No newline at end of file
+        subprocess.call(shlex.split("google-chrome %s" % filename))
+
+
+class WithoutSummaries(object):
+    """
+    Mix in before TestCaseWithApp to run tests with the test app's occurrence
+    summaries disabled, so that the Event methods query the occurrences.
+    """
+
+    def setUp(self):
+        from eventtools.tests.eventtools_testapp.models import ExampleEvent
+        ExampleEvent.SummaryModel = classmethod(lambda cls: None)
+        super(WithoutSummaries, self).setUp()
+
+    def tearDown(self):
+        from eventtools.tests.eventtools_testapp.models import ExampleEvent
+        super(WithoutSummaries, self).tearDown()
+        del ExampleEvent.SummaryModel
@@ -0,0 +1,133 @@
+# -*- coding: utf-8“ -*-
+from datetime import date, datetime
+
+from django.contrib import admin
+from django.test.client import RequestFactory
+
+from eventtools.admin import EventAdmin, EventForm, _convert_to_oneoff, \
+    _remove_occurrences
+from eventtools.filters import IsGeneratedListFilter
+from eventtools.tests._fixture import fixture
+from eventtools.tests._inject_app import TestCaseWithApp as AppTestCase, \
+    WithoutSummaries
+from eventtools.tests.eventtools_testapp.models import *
+from eventtools.models import Rule
+
+class TestEventAdmin(AppTestCase):
+    """
+    The event changelist is annotated with everything it shows, so a page of
+    events takes one query.
+    """
+
+    def setUp(self):
+        super(TestEventAdmin, self).setUp()
+        fixture(self)
+        self.admin = EventAdmin(ExampleEvent)(ExampleEvent, admin.site)
+        # the test app's URLconf doesn't include the admin
+        self.admin.occurrence_edit_url = lambda event: '/%s/' % event.pk
+        self.request = RequestFactory().get('/')
+
+    def columns(self, event):
+        return (self.admin.occurrence_link(event), event.is_listed(),
+            event.season(), event.status())
+
+    def test_changelist_queries(self):
+        with self.assertNumQueries(1):
+            events = list(self.admin.queryset(self.request))
+            columns = [self.columns(e) for e in events]
+
+        # the same as without annotations
+        expected = [self.columns(e) for e in ExampleEvent.eventobjects.all()]
+        self.ae(columns, expected)
+        listed = [e for e, c in zip(events, columns) if c[1]]
+        self.ae(set(listed), set(ExampleEvent.eventobjects.in_listings()))
+        self.assertTrue(self.film in listed)
+        self.assertFalse(self.film_with_talk in listed)
+
+    def test_variation_form(self):
+        form = EventForm(ExampleEvent)(initial={'parent': self.film.pk})
+        self.ae(form.initial['title'], "Film Night")
+        form = EventForm(ExampleEvent)(initial={'parent': self.film.pk,
+            'title': "Film Night Two"})
+        self.ae(form.initial['title'], "Film Night Two")
+
+class TestEventAdminWithoutSummaries(WithoutSummaries, TestEventAdmin):
+    """
+    The same tests, with the Event methods querying the occurrences instead
+    of reading summaries.
+    """
+
+class MessageRecorder(object):
+    def __init__(self):
+        self.messages = []
+
+    def message_user(self, request, message):
+        self.messages.append(message)
+
+class TestOccurrenceActions(AppTestCase):
+    """
+    The occurrence admin actions that add exclusions do so in bulk, and don't
+    save or delete occurrences one at a time.
+    """
+
+    def setUp(self):
+        super(TestOccurrenceActions, self).setUp()
+        self.event = ExampleEvent.eventobjects.create(title="Talk", slug="talk")
+        weekly = Rule.objects.create(frequency="WEEKLY")
+        self.generator = self.event.generators.create(
+            start=datetime(2010,1,1,9,0), _duration=60, rule=weekly,
+            repeat_until=date(2010,3,31))
+        self.oneoff = self.event.occurrences.create(start=datetime(2010,1,2,9,0))
+        self.occurrences = self.event.occurrences.all()
+        self.generated = list(self.occurrences.filter(generated_by__isnull=False)[:4])
+        # an existing exclusion (which makes its occurrence one-off), and an
+        # occurrence that can't be deleted
+        self.event.exclusions.create(start=self.generated[0].start)
+        ExampleTicket.objects.create(occurrence=self.generated[1])
+        self.selected = self.occurrences.filter(
+            pk__in=[o.pk for o in self.generated] + [self.oneoff.pk])
+        self.admin = MessageRecorder()
+
+    def test_remove_occurrences(self):
+        count = self.occurrences.count()
+        _remove_occurrences(self.admin, RequestFactory().get('/'), self.selected)
+
+        self.ae(self.occurrences.count(), count - 4)
+        self.ae(self.occurrences.get(pk=self.generated[1].pk).generated_by, None)
+        self.ae(set(self.event.exclusions.values_list('start', flat=True)),
+            set(o.start for o in self.generated))
+        self.ae(self.admin.messages, ["Deleted 4 occurrences. "
+            "1 occurrence is used elsewhere, so was made one-off instead. "
+            "Added 3 exclusions, so they won't be recreated by repeating occurrences."])
+        self.ae(self.event.reload().occurrence_summary.occurrence_count,
+            count - 4)
+
+        # the generator doesn't recreate them
+        self.generator.save()
+        self.ae(self.occurrences.count(), count - 4)
+
+    def test_remove_filtered_occurrences(self):
+        # the changelist's queryset, filtered to generated occurrences
+        request = RequestFactory().get('/')
+        generated = IsGeneratedListFilter(request, {'method': 'generated'},
+            ExampleOccurrence, None).queryset(request, self.selected)
+        count = self.occurrences.count()
+        _remove_occurrences(self.admin, request, generated)
+
+        self.ae(self.occurrences.count(), count - 2)
+        self.ae(self.admin.messages, ["Deleted 2 occurrences. "
+            "1 occurrence is used elsewhere, so was made one-off instead. "
+            "Added 3 exclusions, so they won't be recreated by repeating occurrences."])
+
+    def test_convert_to_oneoff(self):
+        count = self.occurrences.count()
+        with self.assertNumQueries(5):
+            _convert_to_oneoff(self.admin, RequestFactory().get('/'), self.selected)
+
+        self.ae(self.selected.filter(generated_by__isnull=False).count(), 0)
+        self.ae(self.event.exclusions.count(), 4)
+        self.ae(self.admin.messages, ["Made 3 occurrences one-off. "
+            "Added 3 exclusions, so they won't be recreated by repeating occurrences."])
+
+        self.generator.save()
+        self.ae(self.occurrences.count(), count)
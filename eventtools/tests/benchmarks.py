@@ -0,0 +1,233 @@
+"""
+Rough benchmarks comparing eventtools' query-minimal code paths with the
+implementations they replaced. They are not part of the test suite; run them
+against your own data from a shell, eg:
+
+    ./manage.py shell
+    >>> from eventtools.tests.benchmarks import benchmark_in_listings
+    >>> benchmark_in_listings(Event.eventobjects.all())
+"""
+import sys
+from datetime import date, timedelta
+from timeit import default_timer
+
+from dateutil.relativedelta import relativedelta
+from django.db import connection, models
+
+
+def measure(fn, repeat=3):
+    """
+    Calls fn() `repeat` times. Returns a tuple of the best time taken in
+    seconds, and the number of queries run by one call.
+    """
+    best = None
+    queries = 0
+    old_use_debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    try:
+        for i in range(repeat):
+            del connection.queries[:]
+            started = default_timer()
+            fn()
+            taken = default_timer() - started
+            queries = len(connection.queries)
+            if best is None or taken < best:
+                best = taken
+    finally:
+        connection.use_debug_cursor = old_use_debug_cursor
+    return best, queries
+
+
+def compare(name, implementations, repeat=3):
+    """
+    Measures and prints each of the (label, fn) implementations.
+    """
+    print name
+    for label, fn in implementations:
+        seconds, queries = measure(fn, repeat)
+        print "    %-30s %8.4fs %6s queries" % (label, seconds, queries)
+
+
+# The implementations that have been replaced, kept for comparison.
+
+def in_listings_by_level(qs):
+    """
+    The original, breadth-first EventQuerySet.in_listings(), which runs
+    queries and builds nested subqueries for each level of the tree.
+    """
+    max_level = qs.aggregate(models.Max('level'))['level__max']
+
+    result = qs.filter(level=0).having_occurrences()
+    remaining = qs.filter(level=0).having_no_occurrences()
+
+    for level in range(1, max_level+1):
+        if remaining:
+            result |= qs.filter(parent__in=remaining).having_occurrences()
+            remaining = qs.filter(parent__in=remaining).having_no_occurrences()
+
+    return result
+
+
+def benchmark_in_listings(event_qs, repeat=3):
+    compare("EventQuerySet.in_listings()", [
+        ("by level (original)", lambda: list(in_listings_by_level(event_qs))),
+        ("MPTT columns", lambda: list(event_qs.in_listings())),
+    ], repeat)
+
+
+def opening_occurrences_per_event(qs):
+    """
+    The original EventQuerySet.opening_occurrences(), which runs queries for
+    each event.
+    """
+    pks = []
+    for e in qs:
+        try:
+            pks.append(e.opening_occurrence().id)
+        except AttributeError:
+            pass
+    return qs.occurrences().filter(pk__in=pks)
+
+
+def benchmark_opening_occurrences(event_qs, repeat=3):
+    compare("EventQuerySet.opening_occurrences()", [
+        ("per event (original)",
+            lambda: list(opening_occurrences_per_event(event_qs))),
+        ("grouped query", lambda: list(event_qs.opening_occurrences())),
+    ], repeat)
+
+
+class DictDecoratedDate(object):
+    """
+    The original DecoratedDate, with an instance dictionary and its own set
+    of classes.
+    """
+    def __init__(self, date, href=None, classes=[], data=""):
+        self.date = date
+        self.href = href
+        self.classes = classes
+        self.data = data
+
+
+def decorate_month_per_date(day, date_class_fn):
+    """
+    The original calendar decoration, which works out every date's classes
+    from scratch.
+    """
+    from eventtools.templatetags.calendar import _month_weeks
+    today = date.today()
+    decorated_weeks = []
+    for week in _month_weeks(day):
+        decorated_week = []
+        for wday in week:
+            classes = set(date_class_fn(wday))
+            if wday == today:
+                classes.add('today')
+            if wday.month != day.month:
+                if wday < day:
+                    classes.add('last_month')
+                if wday > day:
+                    classes.add('next_month')
+            classes.add(wday.strftime('%A').lower())
+            decorated_week.append(DictDecoratedDate(date=wday, href=None,
+                classes=classes, data=wday.isoformat()))
+        decorated_weeks.append(decorated_week)
+    return decorated_weeks
+
+
+def footprint(months):
+    """
+    Returns the bytes taken by the decorated dates in months (lists of weeks)
+    and their classes, counting shared objects once.
+    """
+    seen = set()
+    size = 0
+    for weeks in months:
+        for week in weeks:
+            for d in week:
+                for obj in (d, getattr(d, '__dict__', None), d.classes):
+                    if obj is not None and id(obj) not in seen:
+                        seen.add(id(obj))
+                        size += sys.getsizeof(obj)
+    return size
+
+
+def benchmark_decorated_dates(months=24, repeat=3):
+    """
+    Compares decorating `months` calendar months, with a date highlighted
+    in each week, the original way and with DecoratedDate.
+    """
+    from eventtools.templatetags.calendar import DATE_CLASS_HIGHLIGHT_FACTORY, \
+        _decorate_month
+    first = date.today().replace(day=1)
+    days = [first + relativedelta(months=+i) for i in range(months)]
+    date_class_fn = DATE_CLASS_HIGHLIGHT_FACTORY(
+        [first + timedelta(weeks=i) for i in range(months * 5)], None)
+    today = date.today()
+
+    original = lambda: [decorate_month_per_date(d, date_class_fn) for d in days]
+    current = lambda: [_decorate_month(d, today, date_class_fn, None, None)['weeks']
+        for d in days]
+
+    print "Decorating %s calendar months" % months
+    for label, fn in [("per date (original)", original),
+            ("slots, shared classes", current)]:
+        seconds, queries = measure(fn, repeat)
+        print "    %-30s %8.4fs %8s bytes" % (label, seconds, footprint(fn()))
+
+
+def variations_with_frame_walking(EventModel, parent, number):
+    """
+    Makes `number` new variations of parent as the original EventModel did,
+    with ModelInstanceAwareDefault defaults that walk up the stack to find
+    the parent.
+    """
+    from eventtools.utils.inheritingdefault import ModelInstanceAwareDefault
+    fields = [EventModel._meta.get_field(name)
+        for name, attname in EventModel._inherited_fields]
+    old_defaults = [f.default for f in fields]
+    for f in fields:
+        f.default = ModelInstanceAwareDefault(f.name, f.default)
+    try:
+        events = []
+        for i in range(number):
+            event = EventModel.__new__(EventModel)
+            # skip EventModel.__init__, which now does the inheriting
+            if parent is None:
+                models.Model.__init__(event)
+            else:
+                models.Model.__init__(event, parent=parent)
+            events.append(event)
+        return events
+    finally:
+        for f, default in zip(fields, old_defaults):
+            f.default = default
+
+
+def at_depth(depth, fn):
+    """
+    Calls fn() from `depth` frames down, as from a view or form.
+    """
+    if depth > 0:
+        return at_depth(depth - 1, fn)
+    return fn()
+
+
+def benchmark_event_init(EventModel, parent, number=1000, depth=40, repeat=3):
+    """
+    Compares making `number` new variations of parent (and new events without
+    one), the original way and with EventModel.__init__, `depth` frames down
+    the stack.
+    """
+    compare("EventModel(parent=parent) x %s" % number, [
+        ("frame walking (original)", lambda: at_depth(depth,
+            lambda: variations_with_frame_walking(EventModel, parent, number))),
+        ("__init__", lambda: at_depth(depth,
+            lambda: [EventModel(parent=parent) for i in range(number)])),
+    ], repeat)
+    compare("EventModel() x %s" % number, [
+        ("frame walking (original)", lambda: at_depth(depth,
+            lambda: variations_with_frame_walking(EventModel, None, number))),
+        ("__init__", lambda: at_depth(depth,
+            lambda: [EventModel() for i in range(number)])),
+    ], repeat)
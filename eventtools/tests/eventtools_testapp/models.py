@@ -1,9 +1,19 @@
 from django.db import models
-from eventtools.models import EventModel, OccurrenceModel, GeneratorModel, ExclusionModel
+from eventtools.models import EventModel, OccurrenceModel, GeneratorModel, ExclusionModel, EventSummaryModel
 from django.conf import settings
 
+class RenderedTextField(models.TextField):
+    # like a MarkItUp field: saving it renders the text into another column.
+    def pre_save(self, model_instance, add):
+        value = super(RenderedTextField, self).pre_save(model_instance, add)
+        setattr(model_instance, '_%s_rendered' % self.attname,
+            u"<p>%s</p>" % value if value else u"")
+        return value
+
 class ExampleEvent(EventModel):
     difference_from_parent = models.CharField(max_length=250, blank=True, null=True)
+    description = RenderedTextField(blank=True)
+    _description_rendered = models.TextField(blank=True, editable=False)
     
     def __unicode__(self):
         if self.difference_from_parent and self.parent:
@@ -11,7 +21,7 @@ class ExampleEvent(EventModel):
         return self.title
         
     class EventMeta:
-        fields_to_inherit = ['title',]
+        fields_to_inherit = ['title', 'description']
         
 class ExampleGenerator(GeneratorModel):
     event = models.ForeignKey(ExampleEvent, related_name="generators")    
@@ -23,6 +33,9 @@ class ExampleOccurrence(OccurrenceModel):
 class ExampleExclusion(ExclusionModel):
     event = models.ForeignKey(ExampleEvent, related_name="exclusions")
 
+class ExampleEventSummary(EventSummaryModel):
+    event = models.OneToOneField(ExampleEvent, related_name="occurrence_summary")
+
 class ExampleTicket(models.Model):
     # used to test that an occurrence is unhooked rather than deleted.
     occurrence = models.ForeignKey(ExampleOccurrence, on_delete=models.PROTECT)
\ No newline at end of file
@@ -1,11 +1,9 @@
-from models import ExampleEvent, ExampleOccurrence
+from models import ExampleEvent
 from eventtools.views import EventViews
 from django.conf.urls.defaults import *
 
-class TestEventViews(EventViews):
-    occurrence_qs = ExampleOccurrence.objects.all()
-    event_qs = ExampleEvent.eventobjects.all()
-    
-views = TestEventViews()
-    
-urlpatterns = views.get_urls()
\ No newline at end of file
+views = EventViews(event_qs=ExampleEvent.eventobjects.all())
+
+urlpatterns = patterns('',
+    url(r'^', include(views.urls)),
+)
@@ -0,0 +1,123 @@
+from datetime import date
+
+from django.template.loader import render_to_string
+from django.test.client import RequestFactory
+
+from eventtools.tests._fixture import fixture
+from eventtools.tests._inject_app import TestCaseWithApp as AppTestCase
+from eventtools.tests.eventtools_testapp.models import *
+from eventtools.utils.icalcache import all_events_stamp_key, expire_stamps
+from eventtools.utils.keysetpaginator import KeysetPaginator
+from eventtools.views import EventViews
+
+class TestViewQueries(AppTestCase):
+    """
+    The occurrences listed by the views are fetched with their related
+    objects, so rendering a list doesn't run a query per occurrence.
+    """
+
+    def setUp(self):
+        super(TestViewQueries, self).setUp()
+        fixture(self)
+        self.views = EventViews(event_qs=ExampleEvent.eventobjects.all())
+        self.day = date(2010, 10, 10)
+
+    def render_occurrences(self, occurrences):
+        for occurrence in occurrences:
+            render_to_string('eventtools/_occurrence_in_list.html',
+                {'occurrence': occurrence})
+
+    def test_occurrence_list(self):
+        request = RequestFactory().get('/', {'startdate': '2010-01-01'})
+        # the page is found without counting the occurrences
+        with self.assertNumQueries(1):
+            context = self.views._occurrence_list_context(request,
+                self.views.occurrence_qs)
+            self.render_occurrences(context['occurrence_page'])
+        self.ae(len(context['occurrence_page']), 20)
+
+    def test_occurrence_list_ical(self):
+        # the feed has every occurrence, not just the first page.
+        expire_stamps([all_events_stamp_key(ExampleEvent)])
+        request = RequestFactory().get('/', {'startdate': '2010-01-01'})
+        # variations' titles include their parent's
+        views = EventViews(event_qs=ExampleEvent.eventobjects.all(),
+            occurrence_related=('event__parent',))
+        with self.assertNumQueries(1):
+            ics = "".join(views.occurrence_list_ical(request))
+        self.ae(ics.count("BEGIN:VEVENT"), ExampleOccurrence.objects.after(
+            date(2010, 1, 1)).count())
+
+    def test_on_date(self):
+        context = self.views._on_date_context(RequestFactory().get('/'),
+            self.day)
+        with self.assertNumQueries(1):
+            self.render_occurrences(context['occurrence_pool'])
+
+    def test_signage_on_date(self):
+        context = self.views._signage_on_date_context(
+            RequestFactory().get('/'), self.day)
+        with self.assertNumQueries(1):
+            html = render_to_string('eventtools/signage_on_date.html', context)
+        self.assertTrue("A performance" in html)
+
+        # views that don't group the occurrences are regrouped as before
+        del context['day_list']
+        self.ae(render_to_string('eventtools/signage_on_date.html',
+            context).split(), html.split())
+
+    def test_event_prefetch(self):
+        views = EventViews(event_qs=ExampleEvent.eventobjects.all(),
+            event_prefetch=('occurrences',))
+        context = views._on_date_context(RequestFactory().get('/'), self.day)
+        with self.assertNumQueries(2):
+            for occurrence in context['occurrence_pool']:
+                list(occurrence.event.occurrences.all())
+
+
+class TestKeysetPagination(AppTestCase):
+    """
+    Occurrence listings are paginated by (start, event_id, pk), with cursor
+    tokens for the next and previous pages.
+    """
+
+    def setUp(self):
+        super(TestKeysetPagination, self).setUp()
+        fixture(self)
+        self.pool = ExampleOccurrence.objects.all()
+        self.ordered = list(self.pool.order_by('start', 'event__id', 'pk'))
+
+    def test_pages(self):
+        paginator = KeysetPaginator(self.pool, 7)
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            with self.assertNumQueries(1):
+                pages.append(paginator.page(pages[-1].next_page_number()))
+
+        self.ae(sum([p.object_list for p in pages], []), self.ordered)
+        self.assertFalse(pages[0].has_previous())
+        self.ae(pages[-1].end_index(), len(self.ordered))
+        for i, page in enumerate(pages):
+            self.ae(page.start_index(), i * 7 + 1)
+            self.ae(page.has_previous(), i > 0)
+            if i:
+                previous = paginator.page(page.previous_page_number())
+                self.ae(previous.object_list, pages[i-1].object_list)
+                self.ae(previous.start_index(), pages[i-1].start_index())
+                self.ae(previous.has_previous(), i > 1)
+
+        # page numbers, for old links
+        self.ae(paginator.page('3').object_list, pages[2].object_list)
+        self.ae(paginator.page('3').start_index(), 15)
+        # out of range page numbers get the last page
+        last = paginator.page('9999')
+        self.ae(last.object_list, self.ordered[-7:])
+        self.ae(last.end_index(), len(self.ordered))
+        self.assertFalse(last.has_next())
+        self.ae(paginator.page('nonsense').object_list, pages[0].object_list)
+
+    def test_count(self):
+        self.ae(KeysetPaginator(self.pool, 7).count, len(self.ordered))
+        paginator = KeysetPaginator(self.pool, 7, count_limit=10)
+        self.ae(paginator.count, 11)
+        self.ae(paginator.num_pages, 2)
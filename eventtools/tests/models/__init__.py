@@ -2,4 +2,5 @@ from event import *
 from generator import *
 from occurrence import *
 from exclusion import *
-from tree import *
\ No newline at end of file
+from tree import *
+from summary import *
\ No newline at end of file
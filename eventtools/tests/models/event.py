@@ -1,5 +1,6 @@
 from django.test import TestCase
-from eventtools.tests._inject_app import TestCaseWithApp as AppTestCase
+from eventtools.tests._inject_app import TestCaseWithApp as AppTestCase, \
+    WithoutSummaries
 from eventtools.tests.eventtools_testapp.models import *
 from eventtools.tests._fixture import fixture
 from datetime import date, time, datetime, timedelta
@@ -154,6 +155,14 @@ class TestEvents(AppTestCase):
         o2 = [a.closing_occurrence() for a in ExampleEvent.eventobjects.all()]
         self.ae(set(o), set(o2))
 
+        # including when simultaneous occurrences in the tree have to be
+        # ordered by event.
+        self.film_with_talk_occ.start = self.film_with_popcorn_occ.start
+        self.film_with_talk_occ.save()
+        events = self.film.get_descendants(include_self=True)
+        self.ae(set(events.opening_occurrences()), set([a.opening_occurrence() for a in events]))
+        self.ae(set(events.closing_occurrences()), set([a.closing_occurrence() for a in events]))
+
     def test_change_cascade(self):       
         """
         TestEvents are in an mptt tree, which indicates parents (more general) and children (more specific).
@@ -189,6 +198,60 @@ class TestEvents(AppTestCase):
         # reload everything
         reload_films(self)
 
+    def test_bulk_cascade(self):
+        """
+        Changes cascade to the whole subtree with one query for the saved
+        values and one update per changed field and value.
+        """
+        self.film_with_talk.title = "Film Night with talk"
+        self.film_with_talk.save()
+
+        self.film.title = "Irish fillum night"
+        self.assertNumQueries(2, self.film._cascade_changes_to_children)
+        reload_films(self)
+        self.ae(self.film_with_popcorn.title, "Irish fillum night")
+        self.ae(self.film_with_talk.title, "Film Night with talk")
+        self.ae(self.film_with_talk_and_popcorn.title, "Film Night with talk")
+
+        # nothing changed, nothing to update
+        self.assertNumQueries(1, self.film_with_talk._cascade_changes_to_children)
+
+    def test_saved_cascade(self):
+        """
+        Fields that do more than store their value when they're saved are
+        cascaded by saving the descendants instead.
+        """
+        self.film.description = "Films, shown weekly"
+        self.film.save()
+        reload_films(self)
+        self.ae(self.film_with_talk_and_popcorn.description, "Films, shown weekly")
+        self.ae(self.film_with_talk_and_popcorn._description_rendered,
+            "<p>Films, shown weekly</p>")
+
+        # with one query for the saved values, and a save per variation (and
+        # the variation with a variation of its own expires its feed).
+        self.film.description = "Films, shown nightly"
+        with self.assertNumQueries(1 + 3 * 2 + 1):
+            self.film._cascade_changes_to_children()
+        self.ae(self.film_with_popcorn.reload()._description_rendered,
+            "<p>Films, shown nightly</p>")
+
+    def test_inheritance(self):
+        """
+        A new variation inherits its parent's values of fields_to_inherit,
+        unless they're given.
+        """
+        self.ae(ExampleEvent(parent=self.film).title, "Film Night")
+        self.ae(ExampleEvent(parent=self.film, title="Shorts").title, "Shorts")
+        self.ae(ExampleEvent().title, "")
+        variation = ExampleEvent.eventobjects.create(parent=self.talk,
+            slug="talk-with-wine", difference_from_parent="with wine")
+        self.ae(variation.title, "Curator's Talk")
+
+        # and forms for new variations start with them
+        self.ae(self.film.variation_initial(),
+            {'parent': self.film.pk, 'title': "Film Night"})
+
     def test_diffs(self):
         self.ae(unicode(self.film), u'Film Night')
         self.ae(unicode(self.film_with_talk), u'Film Night (director\'s talk)')
@@ -225,4 +288,8 @@ class TestEvents(AppTestCase):
         e.occurrences.create(start=datetime.combine(d2, t2), _duration=25*60)
         self.ae(e.times_description(), "Times vary")
 
-
+class TestEventsWithoutSummaries(WithoutSummaries, TestEvents):
+    """
+    The same tests, with the Event methods querying the occurrences instead
+    of reading summaries.
+    """
@@ -7,6 +7,7 @@ from eventtools.tests._fixture import generator_fixture
 from eventtools.tests._fixture import fixture
 from django.core.urlresolvers import reverse
 from eventtools.models import Rule
+from eventtools.models.exclusion import load_excluded_starts
 from django.core.exceptions import ValidationError
 from django.db import IntegrityError
 
@@ -138,4 +139,60 @@ class TestExclusions(AppTestCase):
         self.ae(event.occurrences.filter(start = clashingtime2).count(), 0)
 
         # overall, there is one less occurrence
-        self.ae(event.occurrences.count(), 52)
\ No newline at end of file
+        self.ae(event.occurrences.count(), 52)
+
+    def test_bulk_exclude(self):
+        """
+        bulk_exclude() adds many exclusions, and unhooks the occurrences they
+        clash with, in a constant number of queries.
+        """
+        generator_fixture(self)
+        holidays = [datetime(2010,1,8,10,30), datetime(2010,1,15,10,30),
+            datetime(2010,1,9,10,30)]
+        self.bin_night.exclusions.create(start=holidays[0])
+        pairs = [(self.bin_night, start) for start in holidays] + \
+            [(self.talk.pk, start) for start in holidays]
+
+        with self.assertNumQueries(4):
+            added, unhooked = ExampleExclusion.objects.bulk_exclude(pairs)
+        # bin night is on at 10:30 on Fridays and Saturdays, and the first
+        # occurrence was unhooked when its exclusion was created.
+        self.ae((added, unhooked), (5, 2))
+        self.ae(self.bin_night.exclusions.count(), 3)
+        self.ae(self.talk.exclusions.count(), 3)
+        self.ae(self.bin_night.occurrences.filter(start__in=holidays,
+            generated_by__isnull=False).count(), 0)
+
+        # no excluded occurrence is regenerated
+        self.bin_night.occurrences.filter(start__in=holidays).delete()
+        self.weekly_generator.save()
+        self.endless_generator.save()
+        self.ae(self.bin_night.occurrences.filter(start__in=holidays).count(), 0)
+
+    def test_is_exclusion(self):
+        """
+        is_exclusion() checks an index of the event's excluded starts, which
+        is loaded once.
+        """
+        generator_fixture(self)
+        event = self.bin_night
+        occurrences = list(event.occurrences.all()[:5])
+        for o in occurrences:
+            o.event = event
+        event.exclusions.create(start=occurrences[1].start)
+
+        with self.assertNumQueries(1):
+            self.ae([o.is_exclusion() for o in occurrences],
+                [False, True, False, False, False])
+
+        # the index is updated when the event's exclusions change
+        exclusion = event.exclusions.create(start=occurrences[2].start)
+        self.assertTrue(occurrences[2].is_exclusion())
+        exclusion.delete()
+        self.assertFalse(occurrences[2].is_exclusion())
+
+        # load_excluded_starts() loads the index of many events in one query
+        events = list(ExampleEvent.eventobjects.all())
+        with self.assertNumQueries(1):
+            load_excluded_starts(events)
+            self.ae([e for e in events if e.excluded_starts()], [event])
@@ -555,3 +555,149 @@ class TestGenerators(AppTestCase):
         self.ae(event.occurrences.filter(generated_by__isnull=True).count(), 1)
         self.ae(event.occurrences.count(), 1)
 
+    def test_resync_is_stable(self):
+        """
+        Re-saving an unchanged generator leaves its occurrences untouched: no
+        occurrences are added, removed or recreated.
+        """
+        ids = set(self.endless_generator.occurrences.values_list('id', flat=True))
+        dupe_count = self.dupe_weekly_generator.occurrences.count()
+
+        self.endless_generator.save()
+        self.dupe_weekly_generator.save()
+
+        self.ae(set(self.endless_generator.occurrences.values_list('id', flat=True)), ids)
+        self.ae(self.dupe_weekly_generator.occurrences.count(), dupe_count)
+
+    def test_sync_unhooks_excluded_occurrences(self):
+        """
+        An occurrence that I generated but which is now excluded is deleted by
+        the sync, or unhooked if something is FKed to it.
+        """
+        occs = list(self.weekly_generator.occurrences.all()[:2])
+        ticket = ExampleTicket.objects.create(occurrence=occs[0])
+        # add the exclusions without ExclusionModel.save() unhooking them.
+        ExampleExclusion.objects.bulk_create([
+            ExampleExclusion(event=self.bin_night, start=o.start) for o in occs])
+
+        self.weekly_generator._sync_occurrences()
+
+        self.ae(ExampleOccurrence.objects.get(pk=occs[0].pk).generated_by, None)
+        self.ae(ExampleOccurrence.objects.filter(pk=occs[1].pk).count(), 0)
+        self.ae(self.weekly_generator.occurrences.count(), 3)
+
+    def test_shift_occurrences(self):
+        """
+        shift_occurrences() timeshifts all my occurrences in bulk, and returns
+        the number of occurrences it touched.
+        """
+        self._reset_generator_fixture()
+
+        # shift onto the start of the next occurrence, so that a naive
+        # row-by-row update would clash with (start, event) uniqueness.
+        updated = self.changeable_generator.shift_occurrences(timedelta(days=7), 90)
+        self.ae(updated, 6)
+
+        new_occurrences = self.changeable_generator.occurrences.all()
+        self.ae(set([x.id for x in new_occurrences]), self.original_generated_occurrence_ids)
+        self.ae(new_occurrences[0].start.date(), date(2011, 1, 3))
+        [self.ae(x.start.time(), time(8,30)) for x in new_occurrences]
+        [self.ae(x.duration, timedelta(seconds=5400)) for x in new_occurrences]
+
+    def test_large_forward_shift(self):
+        """
+        Occurrences can be shifted forward by more than the span they cover,
+        even when they are the last occurrences of all.
+        """
+        event = ExampleEvent.eventobjects.create(title='Late Event', slug='late-event')
+        g = event.generators.create(start=datetime(2030, 1, 1, 9), _duration=60,
+            rule=self.weekly, repeat_until=date(2030, 1, 29))
+        ids = set(g.occurrences.values_list('id', flat=True))
+        self.ae(len(ids), 5)
+
+        g.start += timedelta(days=36)
+        g.repeat_until += timedelta(days=36)
+        g.save()
+
+        self.ae(set(g.occurrences.values_list('id', flat=True)), ids)
+        self.ae([o.start.date() for o in g.occurrences.all()],
+            [date(2030, 2, 6) + timedelta(weeks=i) for i in range(5)])
+
+    def test_changed_occurrence_fields(self):
+        """
+        Generators know which of the fields that affect their occurrences have
+        changed since they were loaded or saved.
+        """
+        g = ExampleGenerator.objects.get(pk=self.weekly_generator.pk)
+        self.ae(g.changed_occurrence_fields(), [])
+
+        g.repeat_until = date(2010, 3, 5)
+        self.ae(g.changed_occurrence_fields(), ['repeat_until'])
+
+        g.save()
+        self.ae(g.changed_occurrence_fields(), [])
+        self.ae(g.occurrences.count(), 9)
+
+        # starts may be given naive, in the default timezone
+        g.start = datetime(2010, 1, 8, 10, 30)
+        self.ae(g.changed_occurrence_fields(), [])
+        g.start = datetime(2010, 1, 8, 11, 00)
+        self.ae(g.changed_occurrence_fields(), ['start'])
+        g.save()
+        self.ae(g.occurrences.all()[0].start.time(), time(11, 00))
+
+    def test_event_save_extends_endless_generators(self):
+        """
+        Saving an event doesn't regenerate its endless generators; it only
+        generates the occurrences after the last generated one.
+        """
+        tail = list(self.endless_generator.occurrences.reverse()[:3])
+        first = self.endless_generator.occurrences.all()[0]
+        count = self.endless_generator.occurrences.count()
+        ExampleOccurrence.objects.filter(pk__in=[o.pk for o in tail + [first]]).delete()
+
+        self.bin_night.save()
+        # the tail is recreated, but not the first occurrence.
+        self.ae(self.endless_generator.occurrences.count(), count - 1)
+        self.ae(self.endless_generator.occurrences.filter(start=first.start).count(), 0)
+        self.ae(self.endless_generator.extend_occurrences(), 0)
+
+        # nor does saving the unchanged generator itself.
+        self.endless_generator.save()
+        self.ae(self.endless_generator.occurrences.count(), count - 1)
+
+        # but changing it regenerates it fully.
+        self.endless_generator._duration += 1
+        self.endless_generator.save()
+        self.ae(self.endless_generator.occurrences.count(), count)
+
+    def test_extend_all(self):
+        """
+        extend_all() extends every endless generator, reporting how many
+        occurrences were created for each.
+        """
+        tail = list(self.endless_generator.occurrences.reverse()[:3])
+        ExampleOccurrence.objects.filter(pk__in=[o.pk for o in tail]).delete()
+
+        results = list(ExampleGenerator.extend_all(batch_size=1))
+        self.ae([(g, created) for g, created, seconds, error in results],
+            [(self.endless_generator, 3)])
+        self.ae(results[0][3], None)
+
+    def test_rule_cache(self):
+        """
+        Rules cache their compiled rrules per start, until they are changed.
+        """
+        dtstart = self.weekly_generator.start
+        rule = Rule.objects.get(pk=self.weekly.pk)
+        self.assertTrue(rule.get_rrule(dtstart) is rule.get_rrule(dtstart))
+        self.assertTrue(rule.get_rrule(dtstart) is not rule.get_rrule(dtstart + timedelta(1)))
+
+        compiled = rule.get_rrule(dtstart)
+        rule.frequency = "DAILY"
+        rule.save()
+        self.assertTrue(rule.get_rrule(dtstart) is not compiled)
+        self.ae(rule.get_rrule(dtstart)[1] - dtstart, timedelta(1))
+
+        rule.frequency = "FORTNIGHTLY"
+        self.assertRaises(ValueError, rule.get_rrule, dtstart)
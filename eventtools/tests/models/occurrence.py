@@ -6,6 +6,15 @@ from eventtools.tests._inject_app import TestCaseWithApp as AppTestCase
 from eventtools.tests.eventtools_testapp.models import *
 from datetime import date, time, datetime, timedelta
 from eventtools.utils import datetimeify
+from eventtools.utils.viewutils import response_as_ical, render_vevents
+from eventtools.utils.icalcache import ical_response, event_stamp_key, \
+    expire_stamps, cached_vevents, get_stamp
+from eventtools.conf import settings
+from django.core.signals import request_finished
+from django.test.client import RequestFactory
+from django.utils.timezone import override, utc
+from vobject import iCalendar
+import re
 
 class TestOccurrences(AppTestCase):
     """
@@ -131,6 +140,160 @@ class TestOccurrences(AppTestCase):
         self.assertTrue(o.time_to_go() < timedelta(0))
         self.ae(o2.time_to_go(), timedelta(0))
 
+    def test_ical_stream(self):
+        """
+        response_as_ical streams the same iCal file as serialising a vobject
+        iCalendar with every occurrence added by as_icalendar() (apart from
+        the generated UIDs and DTSTAMPs), in one query.
+        """
+        request = RequestFactory().get('/')
+        ExampleOccurrence.objects.create(event=self.talk, start=datetime(2010,10,12)) # all day
+
+        def as_icalendar(occurrences, cal_name):
+            ical = iCalendar()
+            ical.add('X-WR-CALNAME').value = cal_name
+            ical.add('X-WR-CALDESC').value = settings.ICAL_CALDESC
+            ical.add('method').value = 'PUBLISH'
+            for occ in occurrences:
+                ical = occ.as_icalendar(ical, request)
+            return ical.serialize()
+
+        def normalise(ics):
+            return re.sub(r'(UID|DTSTAMP):[^\r]*', r'\1:', ics)
+
+        for occurrences, cal_name in [
+            (ExampleOccurrence.objects.all(), settings.ICAL_CALNAME),
+            (ExampleOccurrence.objects.none(), settings.ICAL_CALNAME),
+            (self.talk.occurrences.all(), unicode(self.talk)),
+            (self.talk.occurrences.order_by('-start'), unicode(self.talk)), # all day first
+        ]:
+            expected = as_icalendar(occurrences, cal_name)
+            streamed = "".join(response_as_ical(request, occurrences))
+            self.ae(normalise(streamed), normalise(expected))
+
+        # the events are loaded with the occurrences
+        with self.assertNumQueries(1):
+            "".join(response_as_ical(request, self.talk.occurrences.all()))
+
+        streamed = "".join(response_as_ical(request, self.talk_morning))
+        self.ae(normalise(streamed),
+            normalise(as_icalendar([self.talk_morning], unicode(self.talk))))
+
+    def test_ical_conditional_get(self):
+        """
+        iCal feeds have an ETag and Last-Modified, and get a 304 Not Modified
+        response if the client has the current version. The version changes
+        when the event's occurrences change.
+        """
+        key = event_stamp_key(ExampleEvent, self.talk.pk)
+        expire_stamps([key])
+        occurrences = self.talk.occurrences.all()
+
+        response = ical_response(RequestFactory().get('/'), key, occurrences)
+        self.ae(response.status_code, 200)
+        ics = "".join(response)
+        etag = response['ETag']
+
+        request = RequestFactory().get('/', HTTP_IF_NONE_MATCH=etag)
+        with self.assertNumQueries(0):
+            response = ical_response(request, key, occurrences)
+        self.ae(response.status_code, 304)
+        self.ae(response['ETag'], etag)
+
+        request = RequestFactory().get('/',
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.ae(ical_response(request, key, occurrences).status_code, 304)
+
+        # a client without the current version gets the cached feed
+        with self.assertNumQueries(0):
+            response = ical_response(RequestFactory().get('/'), key, occurrences)
+        self.ae("".join(response), ics)
+
+        self.talk_morning.status = settings.OCCURRENCE_STATUS_CANCELLED[0]
+        self.talk_morning.save()
+        request = RequestFactory().get('/', HTTP_IF_NONE_MATCH=etag)
+        response = ical_response(request, key, occurrences)
+        self.ae(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertTrue("CANCELLED" in "".join(response))
+
+    def test_stamps_expired_after_request(self):
+        """
+        Stamps expired in a transaction are expired again at the end of the
+        request, in case a feed request made a new stamp for the old feed
+        before the transaction was committed.
+        """
+        key = event_stamp_key(ExampleEvent, self.talk.pk)
+        self.talk_morning.status = settings.OCCURRENCE_STATUS_CANCELLED[0]
+        self.talk_morning.save()
+        stamp = get_stamp(key)
+
+        request_finished.send(sender=self.__class__)
+        self.assertNotEqual(get_stamp(key), stamp)
+        stamp = get_stamp(key)
+        request_finished.send(sender=self.__class__)
+        self.ae(get_stamp(key), stamp)
+
+    def test_cached_vevents(self):
+        """
+        The serialised VEVENTs of each occurrence are cached until its event
+        changes.
+        """
+        request = RequestFactory().get('/')
+        occurrences = list(ExampleOccurrence.objects.select_related('event'))
+        expire_stamps(event_stamp_key(ExampleEvent, o.event_id)
+            for o in occurrences)
+
+        def uid(vevents):
+            return re.search(r'UID:[^\r]*', vevents).group(0)
+
+        rendered = list(render_vevents(request, occurrences))
+        cached = list(cached_vevents(request, occurrences))
+        self.ae(
+            [(o, re.sub(r'UID:[^\r]*', '', v), t) for o, v, t in rendered],
+            [(o, re.sub(r'UID:[^\r]*', '', v), t) for o, v, t in cached])
+
+        # the same UIDs show that the VEVENTs came from the cache
+        self.ae(list(cached_vevents(request, occurrences)), cached)
+
+        self.talk.save()
+        for (o, v, t), (o2, v2, t2) in zip(cached,
+                cached_vevents(request, occurrences)):
+            self.ae(uid(v) == uid(v2), o.event_id != self.talk.id)
+
+    def test_start_dates(self):
+        """
+        start_dates() returns the set of local dates on which occurrences
+        start, in one query.
+        """
+        qs = ExampleOccurrence.objects.starts_between(date(2010,1,1), date(2010,1,5))
+        with self.assertNumQueries(1):
+            self.ae(qs.start_dates(), set([
+                date(2010,1,1), date(2010,1,3), date(2010,1,4), date(2010,1,5)]))
+        self.ae(self.talk.occurrences.start_dates(),
+            set([date(2010,10,10), date(2010,10,11)]))
+
+    def test_local_days(self):
+        """
+        starts_on() and by_start_date() use dates in the current timezone.
+        """
+        lecture = ExampleEvent.eventobjects.create(title="Lecture", slug="lecture")
+        early = lecture.occurrences.create(start=datetime(2010,10,10,10,0, tzinfo=utc))
+        late = lecture.occurrences.create(start=datetime(2010,10,10,20,0, tzinfo=utc))
+        qs = lecture.occurrences.all()
+
+        with override('UTC'):
+            self.ae(list(qs.starts_on(date(2010,10,10))), [early, late])
+            self.ae(qs.by_start_date(), [(date(2010,10,10), [early, late])])
+
+        with override('Australia/Sydney'): # UTC+11
+            self.ae(list(qs.starts_on(date(2010,10,10))), [early])
+            self.ae(list(qs.starts_on(date(2010,10,11))), [late])
+            self.ae(list(qs.starts_on(datetime(2010,10,10,20,0, tzinfo=utc))), [late])
+            with self.assertNumQueries(1):
+                self.ae(lecture.occurrences.by_start_date(), [
+                    (date(2010,10,10), [early]), (date(2010,10,11), [late])])
+
 """
 TODO
 
@@ -0,0 +1,165 @@
+# -*- coding: utf-8“ -*-
+from eventtools.tests._inject_app import TestCaseWithApp as AppTestCase
+from eventtools.tests.eventtools_testapp.models import *
+from datetime import date, time, datetime, timedelta
+from eventtools.tests._fixture import fixture, generator_fixture, reload_films
+from eventtools.models import Rule
+from eventtools.signals import occurrences_changed
+from django.core.management import call_command
+from django.utils.timezone import now
+
+SUMMARISED_METHODS = [
+    'season', 'status', 'is_finished', 'is_cancelled',
+    'forthcoming_is_cancelled', 'is_fully_booked',
+    'forthcoming_is_fully_booked', 'is_available',
+    'unavailable_status_message', 'times_description',
+]
+
+class TestEventSummaries(AppTestCase):
+
+    def setUp(self):
+        super(TestEventSummaries, self).setUp()
+        fixture(self)
+        generator_fixture(self)
+
+        # some forthcoming occurrences, to test the forthcoming_* methods
+        soon = now().replace(microsecond=0) + timedelta(days=7)
+        self.concert = ExampleEvent.eventobjects.create(title="Concert", slug="concert")
+        self.concert.occurrences.create(start=soon - timedelta(days=30), status='cancelled')
+        self.concert.occurrences.create(start=soon, status='fully booked')
+        self.concert.occurrences.create(start=soon + timedelta(days=1), status='cancelled')
+
+    def assertSummariesCurrent(self):
+        for event in ExampleEvent.eventobjects.all():
+            values = ExampleEventSummary.summarise(event)
+            try:
+                summary = ExampleEventSummary.objects.get(event=event)
+            except ExampleEventSummary.DoesNotExist:
+                self.ae(values['occurrence_count'], 0)
+                continue
+            for field, value in values.items():
+                self.ae(getattr(summary, field), value, "%s.%s" % (event, field))
+
+    def method_results(self, qs=None, methods=SUMMARISED_METHODS):
+        if qs is None:
+            qs = ExampleEvent.eventobjects.all()
+        return [(e.slug, m, getattr(e, m)()) for e in qs for m in methods]
+
+    def test_summaries_match_queries(self):
+        """
+        When summaries are enabled, the Event methods read from them, and give
+        the same results as querying the occurrences.
+        """
+        self.assertSummariesCurrent()
+
+        concert = self.concert.reload()
+        self.ae(concert.is_cancelled(), False)
+        self.ae(concert.is_fully_booked(), True)
+        self.ae(concert.forthcoming_is_fully_booked(), True)
+        self.ae(concert.forthcoming_is_cancelled(), False)
+        self.ae(concert.status(), "(various)")
+        self.ae(self.talk.reload().times_description(), "Times vary")
+
+        concert = concert.reload()
+        with self.assertNumQueries(1): # loading the summary
+            self.ae(concert.unavailable_status_message(), "This event is fully booked.")
+
+        with_summaries = self.method_results()
+        ExampleEventSummary.objects.all().delete()
+        self.ae(with_summaries, self.method_results())
+
+    def test_summaries_are_maintained(self):
+        """
+        Summaries are updated when occurrences are saved, moved or deleted,
+        when generators are saved or deleted, and when occurrences_changed is
+        sent.
+        """
+        # moving an occurrence to another event updates both (and their ancestors)
+        reload_films(self)
+        self.film_with_talk_occ.event = self.performance
+        self.film_with_talk_occ.save()
+        self.assertSummariesCurrent()
+        self.ae(self.film.reload().occurrence_summary.occurrence_count, 3)
+
+        self.talk_morning.delete()
+        self.assertSummariesCurrent()
+
+        self.weekly_generator.start += timedelta(hours=1)
+        self.weekly_generator.save()
+        self.assertSummariesCurrent()
+
+        self.endless_generator.delete()
+        self.assertSummariesCurrent()
+
+        ExampleOccurrence.objects.filter(event=self.performance).update(status='cancelled')
+        occurrences_changed.send(sender=ExampleEvent, event_ids=[self.performance.pk])
+        self.assertSummariesCurrent()
+        self.ae(self.performance.reload().is_cancelled(), True)
+
+        # the summaries can be rebuilt from scratch
+        ExampleEventSummary.objects.all().delete()
+        call_command('rebuild_event_summaries', verbosity=0)
+        self.assertSummariesCurrent()
+        self.ae(ExampleEventSummary.objects.count(), ExampleEvent.eventobjects.count())
+
+    def test_bulk_delete_queries(self):
+        """
+        Occurrences deleted in bulk by a generator are summarised once, not
+        once per occurrence.
+        """
+        event = ExampleEvent.eventobjects.create(parent=self.film,
+            title="Film Season", slug="film-season")
+        generator = event.generators.create(start=datetime(2010, 1, 1, 19),
+            _duration=120, rule=self.weekly, repeat_until=date(2010, 6, 30))
+        self.ae(generator.occurrences.count(), 26)
+
+        generator.repeat_until = date(2010, 1, 1)
+        # (the summaries of the event and its ancestors are refreshed by
+        # occurrences_changed)
+        with self.assertNumQueries(21):
+            generator.save()
+        self.ae(generator.occurrences.count(), 1)
+        self.assertSummariesCurrent()
+
+    def test_moved_event(self):
+        """
+        When a variation is moved to another parent, the summaries of its old
+        and new ancestors are updated.
+        """
+        reload_films(self)
+        film_count = self.film.occurrence_summary.occurrence_count
+        moved = self.film_with_talk.occurrences_in_listing().count()
+        self.assertTrue(moved > 0)
+
+        self.film_with_talk.parent = self.performance
+        self.film_with_talk.save()
+        self.assertSummariesCurrent()
+        self.ae(self.film.reload().occurrence_summary.occurrence_count,
+            film_count - moved)
+        performance = self.performance.reload()
+        self.ae(performance.occurrence_summary.occurrence_count,
+            performance.occurrences_in_listing().count())
+
+    def test_with_listing_summary(self):
+        """
+        EventQuerySet.with_listing_summary() annotates events with the summary
+        of their occurrences in listing, which the Event methods use, so that
+        a listing takes one query.
+        """
+        # times_description needs the stored summary
+        methods = [m for m in SUMMARISED_METHODS if m != 'times_description']
+        ExampleEventSummary.objects.all().delete()
+        queried = self.method_results(methods=methods)
+
+        with self.assertNumQueries(1):
+            annotated = self.method_results(
+                ExampleEvent.eventobjects.with_listing_summary(), methods)
+        self.ae(annotated, queried)
+
+        # it can be combined with in_listings()
+        with self.assertNumQueries(1):
+            annotated = self.method_results(
+                ExampleEvent.eventobjects.in_listings().with_listing_summary(),
+                methods)
+        self.ae(annotated, self.method_results(
+            ExampleEvent.eventobjects.in_listings(), methods))
@@ -90,4 +90,17 @@ class TestEventTree(AppTestCase):
         self.ae(self.glen_tour.occurrences.count(), 4)
 
         [self.ae(o.start.time(), datetime.time(10,30)) for o in self.tour.occurrences.all()]
-        [self.ae(o.start.time(), datetime.time(10,30)) for o in self.glen_tour.occurrences.all()]
\ No newline at end of file
+        [self.ae(o.start.time(), datetime.time(10,30)) for o in self.glen_tour.occurrences.all()]
+
+    def test_in_listings(self):
+        # in_listings() gives the same results as the original, level-by-level
+        # implementation, for all events and for subsets of them.
+        from eventtools.tests.benchmarks import in_listings_by_level
+
+        for qs in [
+            ExampleEvent.eventobjects.all(),
+            ExampleEvent.eventobjects.exclude(pk=self.talks.pk),
+            ExampleEvent.eventobjects.exclude(pk=self.talk2a.pk),
+            self.talks.get_descendants(include_self=True),
+        ]:
+            self.ae(set(qs.in_listings()), set(in_listings_by_level(qs)))
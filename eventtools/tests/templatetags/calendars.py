@@ -0,0 +1,153 @@
+# -*- coding: utf-8“ -*-
+import pickle
+from datetime import date
+
+from django.template import Context, Template
+from django.utils.timezone import override
+
+from eventtools.conf import settings as eventtools_settings
+from eventtools.templatetags import calendar as calendar_tags
+from eventtools.templatetags.calendar import DecoratedDate, nav_calendar, \
+    nav_calendars
+from eventtools.tests._fixture import fixture
+from eventtools.tests._inject_app import TestCaseWithApp as AppTestCase
+from eventtools.tests.eventtools_testapp.models import *
+
+class TestCalendarCache(AppTestCase):
+    """
+    Decorated and rendered calendar months are cached, keyed by everything
+    that they depend on.
+    """
+
+    def setUp(self):
+        super(TestCalendarCache, self).setUp()
+        fixture(self)
+        self.day = date(2010, 10, 10)
+        self.qs = ExampleOccurrence.objects.exclude(
+            event__in=[self.daily_tour, self.weekly_talk])
+
+    def test_month_cache(self):
+        weeks = nav_calendar({}, self.day, self.qs)['weeks']
+        self.assertTrue(nav_calendar({}, self.day, self.qs)['weeks'] is weeks)
+        highlighted = [d.date for w in weeks for d in w if 'highlight' in d.classes]
+        self.ae(highlighted, [date(2010,10,d) for d in (10,11,12,13)])
+
+        # different highlighted dates, or a different selected day, are
+        # different months
+        other = nav_calendar({}, self.day, self.qs.filter(event=self.talk))['weeks']
+        self.assertFalse(other is weeks)
+        self.assertFalse(nav_calendar({}, date(2010,10,11), self.qs)['weeks'] is weeks)
+
+        # months with date functions that don't have a cache_key aren't cached
+        fn = lambda day: set()
+        self.assertFalse(nav_calendar({}, self.day, self.qs, date_class_fn=fn)['weeks'] is
+            nav_calendar({}, self.day, self.qs, date_class_fn=fn)['weeks'])
+
+    def test_local_dates(self):
+        # a list of occurrences is highlighted on the same (local) dates as
+        # a queryset of them
+        def highlighted(qs):
+            weeks = nav_calendar({}, self.day, qs)['weeks']
+            return [d.date for w in weeks for d in w if 'highlight' in d.classes]
+
+        with override('Australia/Sydney'):
+            self.ae(highlighted(list(self.qs)), highlighted(self.qs))
+            # the evening performances are the next morning in Sydney
+            self.assertTrue(date(2010,10,14) in highlighted(list(self.qs)))
+
+    def test_decorated_dates(self):
+        weeks = nav_calendar({}, self.day, self.qs)['weeks']
+        # dates with the same classes share them
+        mondays = [w[0] for w in weeks[1:-1]
+            if 'highlight' not in w[0].classes]
+        self.assertTrue(mondays[0].classes is mondays[1].classes)
+
+        day = weeks[1][0]
+        self.assertRaises(AttributeError, setattr, day, 'href', '/')
+        copy = pickle.loads(pickle.dumps(day, pickle.HIGHEST_PROTOCOL))
+        self.ae((copy.date, copy.href, copy.data), (day.date, day.href, day.data))
+        self.assertTrue(copy.classes is day.classes)
+
+    def test_html_cache(self):
+        template = Template("{% load calendar %}{% nav_calendar day qs %}")
+        html = template.render(Context({'day': self.day, 'qs': self.qs}))
+        self.assertTrue('<a href="/2010/10/13/">' in html)
+
+        # only the highlighted dates are fetched
+        with self.assertNumQueries(1):
+            self.ae(template.render(Context({'day': self.day, 'qs': self.qs})), html)
+
+        # the tag doesn't leave the calendar in the context
+        context = Context({'day': self.day, 'qs': self.qs})
+        template.render(context)
+        self.assertFalse('weeks' in context)
+
+    def test_html_context(self):
+        # the calendar is rendered without the page's context, which the
+        # cache key doesn't cover
+        contexts = []
+        def render_to_string(template_name, context_instance):
+            contexts.append(context_instance)
+            return ''
+        old_render_to_string = calendar_tags.render_to_string
+        calendar_tags.render_to_string = render_to_string
+        try:
+            Template("{% load calendar %}{% nav_calendar day qs %}").render(
+                Context({'day': date(2010, 10, 11), 'qs': self.qs}))
+        finally:
+            calendar_tags.render_to_string = old_render_to_string
+        self.assertTrue('weeks' in contexts[0])
+        self.assertFalse('qs' in contexts[0])
+
+
+def _month(calendar):
+    # the second week of a calendar is always in its month
+    return calendar['weeks'][1][0].date.replace(day=1)
+
+class TestNavCalendars(AppTestCase):
+    """
+    nav_calendars shows a bounded window of months, fetching the dates to
+    highlight in one query.
+    """
+
+    def setUp(self):
+        super(TestNavCalendars, self).setUp()
+        fixture(self)
+        self.qs = self.weekly_talk.occurrences.all()
+
+    def test_window(self):
+        with self.assertNumQueries(1):
+            calendars = nav_calendars({}, self.qs, max_months=3)['calendars']
+        self.ae([_month(c) for c in calendars],
+            [date(2010,1,1), date(2010,2,1), date(2010,3,1)])
+        highlighted = [d.date for w in calendars[0]['weeks'] for d in w
+            if 'highlight' in d.classes]
+        self.ae(highlighted, [date(2010,1,d) for d in (1,8,15,22,29)])
+
+        # by default, up to NAV_CALENDARS_MAX_MONTHS
+        calendars = nav_calendars({}, self.qs)['calendars']
+        self.ae(len(calendars), eventtools_settings.NAV_CALENDARS_MAX_MONTHS)
+        self.ae(_month(calendars[0]), date(2010,1,1))
+
+        # with no limit, up to the last occurrence
+        calendars = nav_calendars({}, self.qs, max_months=0)['calendars']
+        self.ae(_month(calendars[0]), date(2010,1,1))
+        self.ae(_month(calendars[-1]), date(2010,12,1))
+
+    def test_selected_occurrence(self):
+        selected = self.qs.get(start__year=2010, start__month=5, start__day=7)
+        calendars = nav_calendars({}, self.qs, selected, max_months=2)['calendars']
+        self.ae([_month(c) for c in calendars], [date(2010,5,1), date(2010,6,1)])
+        selected_days = [d.date for w in calendars[0]['weeks'] for d in w
+            if 'selected' in d.classes]
+        self.ae(selected_days, [date(2010,5,7)])
+
+        # the days shown from the next month are highlighted too
+        highlighted = [d.date for d in calendars[0]['weeks'][-1]
+            if 'highlight' in d.classes]
+        self.ae(highlighted, [date(2010,6,4)])
+
+    def test_no_occurrences(self):
+        calendars = nav_calendars({}, self.qs.filter(start__year=2000))['calendars']
+        self.ae([_month(c) for c in calendars],
+            [date.today().replace(day=1)])
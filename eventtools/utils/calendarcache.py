@@ -0,0 +1,59 @@
+"""
+The cache of calendar months used by eventtools.templatetags.calendar.
+
+By default months are kept in a bounded in-process LRUCache (see
+CALENDAR_CACHE_SIZE). Set CALENDAR_CACHE_BACKEND to the name of a Django
+cache to share them between processes instead.
+"""
+from hashlib import md5
+
+from eventtools.conf import settings
+from eventtools.utils.lru import LRUCache
+
+
+class DjangoCache(object):
+    """
+    Adapts a Django cache to LRUCache's get/set interface. Keys may be any
+    value with a stable repr, eg. tuples of strings, numbers and dates.
+    """
+
+    def __init__(self, name, timeout=None):
+        from django.core.cache import get_cache
+        self.cache = get_cache(name)
+        self.timeout = timeout
+
+    def _key(self, key):
+        return 'eventtools.calendar.%s' % md5(repr(key)).hexdigest()
+
+    def get(self, key, default=None):
+        return self.cache.get(self._key(key), default)
+
+    def set(self, key, value):
+        self.cache.set(self._key(key), value, self.timeout)
+
+
+class NullCache(object):
+    """
+    Doesn't cache anything.
+    """
+
+    def get(self, key, default=None):
+        return default
+
+    def set(self, key, value):
+        pass
+
+
+def get_calendar_cache():
+    if settings.CALENDAR_CACHE_BACKEND:
+        return DjangoCache(settings.CALENDAR_CACHE_BACKEND,
+            settings.CALENDAR_CACHE_TIMEOUT)
+    if settings.CALENDAR_CACHE_SIZE:
+        return LRUCache(settings.CALENDAR_CACHE_SIZE)
+    return NullCache()
+
+def dates_digest(dates):
+    """
+    Returns a short string identifying a set of dates, for cache keys.
+    """
+    return md5(",".join(sorted(d.isoformat() for d in dates))).hexdigest()
@@ -1,6 +1,12 @@
-from datetime import datetime, date, time
+from datetime import datetime, date, time, timedelta
 
-__all__ = ('datetimeify', 'dayify')
+from django.conf import settings
+from django.utils.timezone import get_current_timezone, \
+    get_current_timezone_name, is_aware, localtime, make_aware
+
+from eventtools.utils.lru import LRUCache
+
+__all__ = ('datetimeify', 'dayify', 'local_day_bounds')
 
 MIN = "min"
 MAX = "max"
@@ -28,4 +34,40 @@ def dayify(d1, d2=None): #returns two datetimes that encompass the day or days g
         end = datetimeify(d2, clamp=MAX)    
     else:
         end = datetimeify(d1, clamp=MAX)
-    return start, end
\ No newline at end of file
+    return start, end
+
+# (day, timezone name): bounds
+_day_bounds = LRUCache(512)
+
+def local_day_bounds(day):
+    """
+    Returns the first and last datetimes of a date (or of the local date of a
+    datetime) in the current timezone, for a start__range lookup. They're
+    aware if USE_TZ is on, and cached.
+    """
+    if isinstance(day, datetime):
+        if is_aware(day):
+            day = localtime(day)
+        day = day.date()
+    if not settings.USE_TZ:
+        return dayify(day)
+
+    key = (day, get_current_timezone_name())
+    bounds = _day_bounds.get(key)
+    if bounds is None:
+        tz = get_current_timezone()
+        # the last moment of the day is the moment before the next one,
+        # which isn't always 23:59:59.999999 local time.
+        start = _local_midnight(day, tz)
+        end = _local_midnight(day + timedelta(1), tz)
+        bounds = (start, end - timedelta(microseconds=1))
+        _day_bounds.set(key, bounds)
+    return bounds
+
+def _local_midnight(day, tz):
+    midnight = datetime.combine(day, time.min)
+    if hasattr(tz, 'localize'):
+        # midnight can be skipped or repeated when daylight saving changes,
+        # which make_aware() refuses.
+        return tz.normalize(tz.localize(midnight, is_dst=False))
+    return make_aware(midnight, tz)
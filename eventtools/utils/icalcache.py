@@ -0,0 +1,185 @@
+"""
+Version stamps for iCal feeds, for conditional GETs and caching serialised
+feeds.
+
+A stamp is a random token and the time it was made. Stamps are kept in
+Django's cache, and are expired (by eventtools.models.feedstamps) when the
+occurrences, generators, exclusions or events they cover change. A new stamp
+is made the next time it's needed, which changes the feed's ETag and
+Last-Modified, and the key under which the serialised feed is cached.
+
+The serialised VEVENTs of each occurrence are cached too, keyed by the stamp
+of its event, so that when a feed has changed, only the occurrences of the
+events that changed are rendered again.
+"""
+import calendar
+from hashlib import md5
+from itertools import islice
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.http import HttpResponseNotModified
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, \
+    quote_etag
+from django.utils.timezone import get_current_timezone_name, now
+
+from eventtools.conf import settings
+from eventtools.utils.viewutils import ical_file_response, ical_stream, \
+    render_vevent
+
+# how many occurrences' VEVENTs to get from the cache at once
+VEVENT_BATCH_SIZE = 100
+
+
+def event_stamp_key(EventModel, event_pk):
+    """
+    The stamp of the feeds of one event's occurrences.
+    """
+    opts = EventModel._meta
+    return 'eventtools.ical.%s.%s.%s' % (
+        opts.app_label, opts.object_name.lower(), event_pk)
+
+def all_events_stamp_key(EventModel):
+    """
+    The stamp of the feeds that may contain any event's occurrences.
+    """
+    opts = EventModel._meta
+    return 'eventtools.ical.%s.%s.all' % (
+        opts.app_label, opts.object_name.lower())
+
+def get_stamp(key):
+    """
+    Returns the (token, created) stamp for key, making one if needed.
+    """
+    stamp = cache.get(key)
+    if stamp is None:
+        stamp = (uuid4().hex, now().replace(microsecond=0))
+        # if another request has just made one, use theirs.
+        cache.add(key, stamp, settings.ICAL_CACHE_TIMEOUT)
+        stamp = cache.get(key) or stamp
+    return stamp
+
+def get_stamps(keys):
+    """
+    Returns a dictionary of the stamps for keys, making them if needed.
+    """
+    stamps = cache.get_many(keys)
+    for key in keys:
+        if key not in stamps:
+            stamps[key] = get_stamp(key)
+    return stamps
+
+def expire_stamps(keys):
+    cache.delete_many(list(keys))
+
+def ical_response(request, stamp_key, occurrences, variant='', not_before=None):
+    """
+    Returns the iCal file of the given occurrences (see response_as_ical),
+    with ETag and Last-Modified headers from the stamp for stamp_key, or a
+    304 Not Modified response if the client has the current version.
+
+    The serialised feed is cached (see ICAL_CACHE_TIMEOUT and
+    ICAL_CACHE_MAX_SIZE) until the stamp changes.
+
+    occurrences may be a function that returns them, so that they're only
+    worked out if the feed isn't cached.
+
+    variant is anything else (eg. a date range that isn't in the URL) that
+    changes the feed. If the feed can change after not_before without the
+    stamp changing (eg. if it depends on today's date), pass not_before.
+    """
+    token, created = get_stamp(stamp_key)
+    etag = md5("%s:%s" % (token, variant)).hexdigest()
+    last_modified = created
+    if not_before is not None and not_before > last_modified:
+        last_modified = min(not_before, now()).replace(microsecond=0)
+    last_modified_timestamp = calendar.timegm(last_modified.utctimetuple())
+
+    if _not_modified(request, etag, last_modified_timestamp):
+        response = HttpResponseNotModified()
+    else:
+        cache_key = 'eventtools.ics.%s' % md5("%s:%s" % (
+            etag, request.build_absolute_uri())).hexdigest()
+        ics = cache.get(cache_key)
+        if ics is None:
+            if callable(occurrences):
+                occurrences = occurrences()
+            response = ical_file_response(_caching(
+                ical_stream(request, occurrences, render=cached_vevents),
+                cache_key))
+        else:
+            response = ical_file_response([ics])
+
+    response['ETag'] = quote_etag(etag)
+    response['Last-Modified'] = http_date(last_modified_timestamp)
+    return response
+
+def cached_vevents(request, occurrences):
+    """
+    Like viewutils.render_vevents, but gets the serialised VEVENTs of each
+    occurrence from the cache, if they've been rendered since its event's
+    stamp was made.
+
+    The VEVENTs contain the occurrence's URL and local times, so they're
+    cached separately for each host, scheme and timezone.
+    """
+    context = "%s:%s:%s" % (request.is_secure(), request.get_host(),
+        get_current_timezone_name())
+    occurrences = iter(occurrences)
+    while True:
+        batch = list(islice(occurrences, VEVENT_BATCH_SIZE))
+        if not batch:
+            break
+        for r in _cached_vevent_batch(request, batch, context):
+            yield r
+
+def _cached_vevent_batch(request, batch, context):
+    stamp_keys = [event_stamp_key(o.EventModel(), o.event_id) for o in batch]
+    stamps = get_stamps(list(set(stamp_keys)))
+
+    keys = []
+    for occurrence, stamp_key in zip(batch, stamp_keys):
+        opts = occurrence._meta
+        keys.append('eventtools.vevent.%s' % md5("%s:%s:%s.%s.%s" % (
+            stamps[stamp_key][0], context, opts.app_label,
+            opts.object_name.lower(), occurrence.pk)).hexdigest())
+
+    cached = cache.get_many(keys)
+    rendered = {}
+    for occurrence, key in zip(batch, keys):
+        fragment = cached.get(key)
+        if fragment is None:
+            fragment = rendered[key] = render_vevent(request, occurrence)
+        vevents, tzids = fragment
+        yield occurrence, vevents, tzids
+    if rendered:
+        cache.set_many(rendered, settings.ICAL_CACHE_TIMEOUT)
+
+def _not_modified(request, etag, last_modified_timestamp):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return etag in etags or '*' in etags
+    if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since:
+        if_modified_since = parse_http_date_safe(if_modified_since)
+        return if_modified_since is not None \
+            and last_modified_timestamp <= if_modified_since
+    return False
+
+def _caching(chunks, cache_key):
+    """
+    Yields chunks, and caches them, joined, once they've all been yielded,
+    unless they're bigger than ICAL_CACHE_MAX_SIZE.
+    """
+    kept, size = [], 0
+    for chunk in chunks:
+        if kept is not None:
+            size += len(chunk)
+            if size > settings.ICAL_CACHE_MAX_SIZE:
+                kept = None
+            else:
+                kept.append(chunk)
+        yield chunk
+    if kept is not None:
+        cache.set(cache_key, "".join(kept), settings.ICAL_CACHE_TIMEOUT)
@@ -6,6 +6,10 @@ from django.db import connection
 
 class ModelInstanceAwareDefault():
     """
+    DEPRECATED: EventModel no longer uses this. New variations inherit their
+    parent's values in EventModel.__init__, and admin forms get them from
+    EventModel.variation_initial().
+
     This callable class provides model instance awareness in order to generate a
     default. It uses 9th level voodoo, so may break if Django changes much.
     Probably much better to patch django to send the model instance and field
@@ -0,0 +1,205 @@
+"""
+Keyset (cursor) pagination of occurrence querysets.
+
+Django's Paginator counts the whole queryset and gets each page with OFFSET,
+so pages get slower the further into the listing they are. KeysetPaginator
+orders occurrences by (start, event_id, pk) and gets each page with a WHERE
+clause that continues from the last (or first) occurrence of the page that
+linked to it, which uses the index on start however deep the page is.
+
+Pages are identified by opaque cursor tokens, which KeysetPage returns from
+next_page_number() and previous_page_number(), so templates written for
+Django's Page (eg. eventtools/_pagination.html) work unchanged.
+"""
+import math
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from django.conf import settings as django_settings
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.timezone import is_aware, make_aware, utc
+
+AFTER = 'a'
+BEFORE = 'b'
+DATETIME_FORMAT = "%Y%m%d%H%M%S%f"
+
+
+class KeysetPaginator(object):
+    """
+    Paginates an occurrence queryset by (start, event_id, pk).
+
+    Counting is only needed for the total shown in templates, and only done
+    if it's asked for. If count_limit is given, occurrences are only counted
+    up to count_limit + 1, so count is approximate for long listings.
+    """
+
+    def __init__(self, pool, per_page, count_limit=None):
+        # order by the event_id column itself; 'event__id' joins the events.
+        opts = pool.model._meta
+        event_id = "%s.%s" % (opts.db_table, opts.get_field('event').column)
+        self.pool = pool.order_by('start', event_id, 'pk')
+        self.per_page = per_page
+        self.count_limit = count_limit
+
+    @cached_property
+    def count(self):
+        pool = self.pool.order_by()
+        if self.count_limit is not None:
+            pool = pool[:self.count_limit + 1]
+        return pool.count()
+
+    @property
+    def num_pages(self):
+        return max(1, int(math.ceil(float(self.count) / self.per_page)))
+
+    def page(self, token=None):
+        """
+        Returns the page identified by token, which is a cursor token or a
+        page number (for old links). Returns the first page if token is None
+        or invalid, and the last page if the page number is out of range.
+        """
+        try:
+            direction, key, offset = decode_cursor(token)
+        except ValueError:
+            direction, key = None, None
+            try:
+                offset = (max(int(token), 1) - 1) * self.per_page
+            except (TypeError, ValueError):
+                offset = 0
+
+        qs = self.pool
+        if direction == AFTER:
+            qs = qs.filter(_after(key))
+        elif direction == BEFORE:
+            qs = qs.filter(_before(key)).reverse()
+        elif offset:
+            # a page number, which is found the slow way.
+            rows = list(qs[offset:offset + self.per_page + 1])
+            if not rows:
+                return self.last_page()
+            return KeysetPage(rows[:self.per_page], self, offset,
+                has_previous=True, has_next=len(rows) > self.per_page)
+
+        rows = list(qs[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if direction == BEFORE:
+            rows.reverse()
+            if not more:
+                if len(rows) < self.per_page:
+                    # keep the first page full.
+                    return self.page()
+                offset = 0
+            return KeysetPage(rows, self, offset, has_previous=more,
+                has_next=True)
+        return KeysetPage(rows, self, offset,
+            has_previous=direction == AFTER, has_next=more)
+
+    def last_page(self):
+        """
+        Returns the last per_page occurrences, as a page.
+        """
+        rows = list(self.pool.reverse()[:self.per_page])
+        if not rows:
+            return self.page()
+        rows.reverse()
+        # the exact offset, which count may not be.
+        offset = self.pool.order_by().count() - len(rows)
+        return KeysetPage(rows, self, offset, has_previous=offset > 0,
+            has_next=False)
+
+
+class KeysetPage(object):
+    """
+    A page of a KeysetPaginator, with the same interface as Django's Page,
+    except that page 'numbers' are cursor tokens.
+    """
+
+    def __init__(self, object_list, paginator, offset, has_previous, has_next):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.offset = offset
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    def __repr__(self):
+        return '<Page starting at %s>' % self.start_index()
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    def next_page_number(self):
+        return encode_cursor(AFTER, self.object_list[-1],
+            self.offset + len(self.object_list))
+
+    def previous_page_number(self):
+        return encode_cursor(BEFORE, self.object_list[0],
+            max(self.offset - self.paginator.per_page, 0))
+
+    def start_index(self):
+        if not self.object_list:
+            return 0
+        return self.offset + 1
+
+    def end_index(self):
+        return self.offset + len(self.object_list)
+
+
+def encode_cursor(direction, occurrence, offset):
+    """
+    Returns a token for the page after or before occurrence, whose first
+    occurrence is at offset in the listing.
+    """
+    start = occurrence.start
+    if is_aware(start):
+        start = start.astimezone(utc).replace(tzinfo=None)
+    value = "%s:%s:%s:%s:%s" % (direction, start.strftime(DATETIME_FORMAT),
+        occurrence.event_id, occurrence.pk, offset)
+    return urlsafe_b64encode(value).rstrip('=')
+
+def decode_cursor(token):
+    """
+    Returns the (direction, (start, event_id, pk), offset) in token. Raises
+    ValueError if token isn't a cursor token.
+    """
+    if not token:
+        raise ValueError("No cursor token")
+    try:
+        value = urlsafe_b64decode(str(token) + '=' * (-len(token) % 4))
+    except TypeError:
+        raise ValueError("Invalid cursor token: %r" % token)
+    parts = value.split(':')
+    if len(parts) != 5 or parts[0] not in (AFTER, BEFORE):
+        raise ValueError("Invalid cursor token: %r" % token)
+    direction, start, event_id, pk, offset = parts
+    start = datetime.strptime(start, DATETIME_FORMAT)
+    if django_settings.USE_TZ:
+        start = make_aware(start, utc)
+    return direction, (start, int(event_id), int(pk)), max(int(offset), 0)
+
+def _after(key):
+    start, event_id, pk = key
+    return Q(start__gt=start) | Q(start=start, event__gt=event_id) | \
+        Q(start=start, event=event_id, pk__gt=pk)
+
+def _before(key):
+    start, event_id, pk = key
+    return Q(start__lt=start) | Q(start=start, event__lt=event_id) | \
+        Q(start=start, event=event_id, pk__lt=pk)
@@ -0,0 +1,56 @@
+from collections import OrderedDict
+from threading import RLock
+
+
+class LRUCache(object):
+    """
+    A simple thread-safe in-process cache, holding at most `maxsize` items.
+    When it is full, the least recently used item is discarded.
+
+    cache = LRUCache(100)
+    cache.set(key, value)
+    cache.get(key) # value, or None (or a given default) if it isn't cached
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = RLock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value # most recently used is last
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_where(self, test):
+        """
+        Discards the items whose keys pass `test`.
+        """
+        with self._lock:
+            for key in [k for k in self._data if test(k)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
@@ -1,9 +1,18 @@
 from django.core.paginator import Paginator, EmptyPage, InvalidPage
 from django.http import HttpResponse
 from eventtools.conf import settings
+from eventtools.utils.keysetpaginator import KeysetPaginator
 from datetime import date
+from cStringIO import StringIO
 from dateutil import parser as dateparser
 from vobject import iCalendar
+from vobject.base import ContentLine
+from vobject.icalendar import TimezoneComponent, getTzid, toUnicode
+
+try:
+    from django.http import StreamingHttpResponse as ResponseClass
+except ImportError: # Django < 1.5 streams HttpResponses given an iterator
+    ResponseClass = HttpResponse
 
 
 def paginate(request, pool):
@@ -23,6 +32,16 @@ def paginate(request, pool):
 
     return pageinfo
 
+def keyset_paginate(request, pool):
+    """
+    Returns the page of the occurrence queryset pool given by the 'page'
+    cursor token in the request, without counting or offsetting through the
+    occurrences before it (see KeysetPaginator).
+    """
+    paginator = KeysetPaginator(pool, settings.OCCURRENCES_PER_PAGE,
+        count_limit=settings.OCCURRENCES_COUNT_LIMIT)
+    return paginator.page(request.GET.get('page'))
+
 def parse_GET_date(GET={}):
     mapped_GET = {}
     for k, v in GET.iteritems():
@@ -48,31 +67,155 @@ def parse_GET_date(GET={}):
     return fr, to
     
 def response_as_ical(request, occurrences):
+    """
+    Returns the given occurrence, or iterable (eg. queryset) of occurrences,
+    as an iCal file.
 
-    ical = iCalendar()
+    The file is streamed, one VEVENT at a time, so that large feeds don't
+    need to be held in memory. The output is the same as serialising a
+    vobject iCalendar that every occurrence has been added to with
+    OccurrenceModel.as_icalendar().
+    """
+    return ical_file_response(ical_stream(request, occurrences))
 
-    cal_name = settings.ICAL_CALNAME
-    # If multiple occurrences with one event, name the calendar after the event
-    if hasattr(occurrences, '__iter__'):
-        events = list(set([o.event for o in occurrences]))
-        if len(events) == 1:
-            cal_name = unicode(events[0])
-    # If a single occurrence with an event
-    elif getattr(occurrences, 'event', None):
-        cal_name = unicode(occurrences.event)
-
-    ical.add('X-WR-CALNAME').value = cal_name
-    ical.add('X-WR-CALDESC').value = settings.ICAL_CALDESC
-    ical.add('method').value = 'PUBLISH'  # IE/Outlook needs this
-
-    if hasattr(occurrences, '__iter__'):
-        for occ in occurrences:
-            ical = occ.as_icalendar(ical, request)
-    else:
-        ical = occurrences.as_icalendar(ical, request)
-    
-    icalstream = ical.serialize()
-    response = HttpResponse(icalstream, mimetype='text/calendar')
+def ical_file_response(chunks):
+    """
+    Returns a response streaming the given chunks of an iCal file.
+    """
+    response = ResponseClass(chunks, content_type='text/calendar')
     response['Filename'] = 'events.ics'  # IE needs this
     response['Content-Disposition'] = 'attachment; filename=events.ics'
     return response
+
+def ical_stream(request, occurrences, render=None):
+    """
+    Yields the serialised iCalendar of the given occurrence, or iterable of
+    occurrences, in chunks.
+
+    render is a function that takes the request and the occurrences and
+    yields (occurrence, serialised VEVENTs, TZIDs they need) for each
+    occurrence, as render_vevents (the default) does.
+
+    vobject puts the VTIMEZONEs for the times used in an iCalendar before
+    the VEVENTs, so VEVENTs are held back until we've seen one with a time
+    (or the end), and the VTIMEZONEs are those that VEVENT needs. (The
+    times of all occurrences are in the current timezone.) The calendar
+    name comes after the VEVENTs.
+    """
+    if not hasattr(occurrences, '__iter__'):
+        occurrences = [occurrences]
+    elif hasattr(occurrences, 'iterator'):
+        # avoid a query per occurrence for the calendar name, and don't
+        # cache the whole queryset.
+        if not occurrences.query.select_related:
+            occurrences = occurrences.select_related('event')
+        occurrences = occurrences.iterator()
+
+    held_back = []
+    tzids = None # not known until we see a VEVENT with a time
+    event = None # the calendar is named after the event, if there's only one
+    event_id = None
+    several_events = False
+
+    for occurrence, vevents, vevent_tzids in \
+            (render or render_vevents)(request, occurrences):
+        if event_id is None:
+            event, event_id = occurrence.event, occurrence.event_id
+        elif occurrence.event_id != event_id:
+            several_events = True
+
+        if tzids is None:
+            if vevent_tzids:
+                tzids = vevent_tzids
+                yield _serialize_ical_head(tzids)
+                for chunk in held_back:
+                    yield chunk
+                held_back = None
+            else:
+                held_back.append(vevents)
+                continue
+        yield vevents
+
+    if tzids is None:
+        yield _serialize_ical_head(set())
+        for chunk in held_back:
+            yield chunk
+
+    cal_name = settings.ICAL_CALNAME
+    if event is not None and not several_events:
+        cal_name = unicode(event)
+    yield _serialize_ical_tail(cal_name)
+
+def render_vevents(request, occurrences):
+    """
+    Yields (occurrence, serialised VEVENTs, TZIDs they need) for each of the
+    given occurrences.
+    """
+    for occurrence in occurrences:
+        vevents, tzids = render_vevent(request, occurrence)
+        yield occurrence, vevents, tzids
+
+def render_vevent(request, occurrence):
+    """
+    Returns a tuple of the serialised VEVENTs that occurrence.as_icalendar()
+    adds to an iCalendar, and the set of TZIDs they need.
+    """
+    scratch = iCalendar()
+    occurrence.as_icalendar(scratch, request)
+    tzids = set()
+    for vevent in scratch.contents.get('vevent', []):
+        _find_tzids(vevent, tzids)
+    return _serialize_vevents(scratch), tzids
+
+def _ical_frame(cal_name=None, tzids=()):
+    """
+    Returns an iCalendar with everything but the VEVENTs.
+    """
+    ical = iCalendar()
+    if cal_name is not None:
+        ical.add('X-WR-CALNAME').value = cal_name
+        ical.add('X-WR-CALDESC').value = settings.ICAL_CALDESC
+    ical.add('method').value = 'PUBLISH'  # IE/Outlook needs this
+    for tzid in tzids:
+        ical.add(TimezoneComponent(tzinfo=getTzid(tzid)))
+    # adds PRODID and VERSION
+    ical.behavior.generateImplicitParameters(ical)
+    return ical
+
+def _serialize_children(ical, keys):
+    buf = StringIO()
+    for key in keys:
+        for child in ical.contents.get(key, []):
+            child.serialize(buf, validate=False)
+    return buf.getvalue()
+
+def _serialize_ical_head(tzids):
+    ical = _ical_frame(tzids=tzids)
+    # ie. the children that vobject sorts before 'vevent'
+    keys = [k for k in ical.sortChildKeys()
+        if k in ical.behavior.sortFirst or k < 'vevent']
+    return "BEGIN:VCALENDAR\r\n" + _serialize_children(ical, keys)
+
+def _serialize_ical_tail(cal_name):
+    ical = _ical_frame(cal_name=cal_name)
+    keys = [k for k in ical.sortChildKeys()
+        if k not in ical.behavior.sortFirst and k > 'vevent']
+    return _serialize_children(ical, keys) + "END:VCALENDAR\r\n"
+
+def _serialize_vevents(ical):
+    return _serialize_children(ical, ['vevent'])
+
+def _find_tzids(obj, tzids):
+    """
+    Adds the TZIDs that need VTIMEZONEs in a calendar containing obj to the
+    set tzids, as vobject's VCalendar2_0.generateImplicitParameters does.
+    """
+    if isinstance(obj, ContentLine):
+        if obj.behavior is None or not obj.behavior.forceUTC:
+            tzid = getattr(obj, 'tzid_param', None) or \
+                TimezoneComponent.registerTzinfo(getattr(obj.value, 'tzinfo', None))
+            if tzid and toUnicode(tzid) != u'UTC':
+                tzids.add(toUnicode(tzid))
+    elif obj.name != 'VTIMEZONE':
+        for child in obj.getChildren():
+            _find_tzids(child, tzids)
@@ -1,14 +1,17 @@
 from dateutil.relativedelta import relativedelta
 
 from django.conf.urls.defaults import *
-from django.core.paginator import Paginator, EmptyPage, InvalidPage
 from django.shortcuts import get_object_or_404, render_to_response
 from django.template.context import RequestContext
 from django.utils.safestring import mark_safe
+from django.utils.timezone import get_current_timezone, make_aware
 
 from eventtools.conf import settings
+from eventtools.models.xtimespan import group_by_start_date
 from eventtools.utils.pprint_timespan import humanized_date_range
-from eventtools.utils.viewutils import paginate, response_as_ical, parse_GET_date
+from eventtools.utils.viewutils import keyset_paginate, parse_GET_date
+from eventtools.utils.icalcache import ical_response, event_stamp_key, \
+    all_events_stamp_key
 
 import datetime
 
@@ -21,15 +24,45 @@ class EventViews(object):
     use Event.eventobjects.all() for event_qs.
 
     It will get filtered to .in_listings() where appropriate.
+
+    occurrence_related and event_prefetch are the related objects that are
+    fetched with the occurrences listed by the views, so that templates
+    don't run queries for each occurrence. occurrence_related are passed to
+    select_related() on the occurrences, and event_prefetch to
+    prefetch_related() on their events, eg.
+
+        EventViews(event_qs=Event.eventobjects.all(),
+            occurrence_related=('event__venue', 'generated_by'),
+            event_prefetch=('tags',))
     """
+    occurrence_related = ('event', 'generated_by')
+    event_prefetch = ()
 
-    def __init__(self, event_qs, occurrence_qs=None):
+    def __init__(self, event_qs, occurrence_qs=None, occurrence_related=None,
+            event_prefetch=None):
         self.event_qs = event_qs
 
         if occurrence_qs is None:
             occurrence_qs = self.event_qs.occurrences()
         self.occurrence_qs = occurrence_qs
 
+        if occurrence_related is not None:
+            self.occurrence_related = occurrence_related
+        if event_prefetch is not None:
+            self.event_prefetch = event_prefetch
+
+    def occurrence_pool(self, qs):
+        """
+        Returns the occurrence queryset qs, fetching the related objects
+        that are shown with each occurrence.
+        """
+        if self.occurrence_related:
+            qs = qs.select_related(*self.occurrence_related)
+        if self.event_prefetch:
+            qs = qs.prefetch_related(
+                *["event__%s" % lookup for lookup in self.event_prefetch])
+        return qs
+
     @property
     def urls(self):
         from django.conf.urls.defaults import patterns, url
@@ -66,7 +99,8 @@ class EventViews(object):
         Returns all of an Event's occurrences as an iCal file
         """
         event = get_object_or_404(self.event_qs, slug=event_slug)
-        return response_as_ical(request, event.occurrences.all())
+        return ical_response(request, event_stamp_key(type(event), event.pk),
+            event.occurrences.all())
 
     def occurrence(self, request, event_slug, occurrence_pk):
         """
@@ -76,7 +110,8 @@ class EventViews(object):
         it would be nice if URLs continued to work.
         """
 
-        occurrence = get_object_or_404(self.occurrence_qs, pk=occurrence_pk)
+        occurrence = get_object_or_404(
+            self.occurrence_pool(self.occurrence_qs), pk=occurrence_pk)
         event = occurrence.event
         context = RequestContext(request)
         context['occurrence'] = occurrence
@@ -89,24 +124,35 @@ class EventViews(object):
         Returns a single Occurrence as an iCal file
         """
         occurrence = get_object_or_404(self.occurrence_qs, pk=occurrence_pk)
-        return response_as_ical(request, occurrence)
+        return ical_response(request,
+            event_stamp_key(occurrence.EventModel(), occurrence.event_id),
+            occurrence)
 
     #occurrence_list
-    def _occurrence_list_context(self, request, qs):
+    def _occurrence_list_pool(self, request, qs):
+        """
+        Returns the start date given in the request, and the occurrences in
+        qs from then (until the end date, if one is given).
+        """
         fr, to = parse_GET_date(request.GET)
 
         if to is None:
             occurrence_pool = qs.after(fr)
         else:
             occurrence_pool = qs.between(fr, to)
+        return fr, self.occurrence_pool(occurrence_pool)
+
+    def _occurrence_list_context(self, request, qs):
+        fr, occurrence_pool = self._occurrence_list_pool(request, qs)
 
-        pageinfo = paginate(request, occurrence_pool)
+        pageinfo = keyset_paginate(request, occurrence_pool)
 
         return {
             'bounded': False,
             'pageinfo': pageinfo,
             'occurrence_pool': occurrence_pool,
             'occurrence_page': pageinfo.object_list,            
+            'day_list': lambda: group_by_start_date(pageinfo.object_list),
             'day': fr,
             'occurrence_qs': qs,
         }
@@ -122,18 +168,35 @@ class EventViews(object):
         """
         Returns an iCal file containing all occurrences returned from `self._occurrence_list`
         """
-        occurrences = self._occurrence_list_context(request, self.occurrence_qs)['occurrence_pool']
-        return response_as_ical(request, occurrences)
+        fr, to = parse_GET_date(request.GET)
+        # Without an end date, the feed is of occurrences from today, so it
+        # changes every day.
+        today = make_aware(datetime.datetime.combine(
+            datetime.date.today(), datetime.time.min), get_current_timezone())
+
+        def occurrences():
+            return self._occurrence_list_pool(request, self.occurrence_qs)[1]
+
+        return ical_response(request,
+            all_events_stamp_key(self.occurrence_qs.model.EventModel()),
+            occurrences, variant="%s:%s" % (fr, to), not_before=today)
+
+    def _on_date_context(self, request, day):
+        occurrence_pool = self.occurrence_pool(
+            self.occurrence_qs.starts_on(day))
+        return {
+            'occurrence_pool': occurrence_pool,
+            'day_list': occurrence_pool.by_start_date,
+            'day': day,
+            'occurrence_qs': self.occurrence_qs,
+        }
 
     def on_date(self, request, year, month, day):
         template = 'eventtools/occurrence_list.html'
         day = datetime.date(int(year), int(month), int(day))
-        event_pool = self.occurrence_qs.starts_on(day)
 
         context = RequestContext(request)
-        context['occurrence_pool'] = event_pool
-        context['day'] = day
-        context['occurrence_qs'] = self.occurrence_qs
+        context.update(self._on_date_context(request, day))
         return render_to_response(template, context)
 
     def today(self, request):
@@ -153,15 +216,21 @@ class EventViews(object):
         """
         template = 'eventtools/signage_on_date.html'
         dt = datetime.date(int(year), int(month), int(day))
-        today = datetime.date.today()
-        occurrences = self.occurrence_qs.starts_on(dt)
 
         context = RequestContext(request)
-        context['occurrence_pool'] = occurrences
-        context['day'] = dt
-        context['is_today'] = dt == today
+        context.update(self._signage_on_date_context(request, dt))
         return render_to_response(template, context)
 
+    def _signage_on_date_context(self, request, day):
+        occurrence_pool = self.occurrence_pool(
+            self.occurrence_qs.starts_on(day))
+        return {
+            'occurrence_pool': occurrence_pool,
+            'day_list': occurrence_pool.by_start_date,
+            'day': day,
+            'is_today': day == datetime.date.today(),
+        }
+
     def index(self, request):
         # In your subclass, you may prefer:
         # return self.today(request)